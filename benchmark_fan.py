@@ -0,0 +1,101 @@
+"""
+Offline comparison of the full binarization fan against histogram-driven skew selection.
+
+Every image in the given directory is expected to be named after the text it contains (ex.: เกล้า.png),
+or a tab-separated labels file with file names and expected texts can be supplied instead.
+For each fan mode the number of Tesseract calls, the time taken and the accuracy of the suggestions are reported.
+
+usage: python benchmark_fan.py <images dir> [--labels labels.tsv] [--kind line]
+"""
+import argparse
+import os
+import threading
+from datetime import datetime as dt
+
+import pytesseract
+
+from screen2text import ClipImg2Text
+
+FANS = ('full', 'histogram')
+
+
+class CallCounter:
+    """Wraps a function to count its calls, made from any number of threads."""
+
+    def __init__(self, func):
+        self.func = func
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self.lock:
+            self.count += 1
+        return self.func(*args, **kwargs)
+
+
+def load_labels(images_dir, labels_path=None):
+    if labels_path:
+        with open(labels_path, encoding='utf-8') as f:
+            rows = [line.rstrip('\n').split('\t') for line in f if line.strip()]
+        return {os.path.join(images_dir, name): text for name, text in rows}
+    return {
+        os.path.join(images_dir, name): os.path.splitext(name)[0]
+        for name in sorted(os.listdir(images_dir))
+        if name.lower().endswith(('.png', '.jpg'))
+    }
+
+
+def run(labels, kind):
+    stats = {fan: {'calls': 0, 'seconds': 0.0, 'top': 0, 'any': 0} for fan in FANS}
+    x = ClipImg2Text()
+    # recognized variants do not map to Tesseract calls one to one (e.g. split regions are joined), so calls are
+    # counted where they are made
+    counter = CallCounter(pytesseract.image_to_string)
+    pytesseract.image_to_string = counter
+    try:
+        for path, expected in labels.items():
+            x.load_image(path)
+            row = []
+            for fan in FANS:
+                calls = counter.count
+                start = dt.now()
+                x.threads_recognize(lang='tha', kind=kind, fan=fan)
+                x.generate_word_suggestions()
+                elapsed = (dt.now() - start).total_seconds()
+                calls = counter.count - calls
+                suggested = [item[0] for item in x.suggestions]
+                stat = stats[fan]
+                stat['calls'] += calls
+                stat['seconds'] += elapsed
+                stat['top'] += bool(suggested) and suggested[0] == expected
+                stat['any'] += expected in suggested
+                row.append(f'{fan}: {calls} calls, {elapsed:.1f} s, {suggested[:3]}')
+            print(f'{os.path.basename(path)} ({expected})\n    ' + '\n    '.join(row))
+    finally:
+        pytesseract.image_to_string = counter.func
+    return stats
+
+
+def report(stats, total):
+    print(f'\n{total} image(s)')
+    print(f'{"fan":<10}{"calls/img":>10}{"s/img":>8}{"top-1":>8}{"any":>8}')
+    for fan, stat in stats.items():
+        print(f'{fan:<10}{stat["calls"] / total:>10.1f}{stat["seconds"] / total:>8.2f}'
+              f'{stat["top"] / total:>8.0%}{stat["any"] / total:>8.0%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare full and histogram-driven binarization fans.')
+    parser.add_argument('images_dir')
+    parser.add_argument('--labels', help='tab-separated file name and expected text per line')
+    parser.add_argument('--kind', default='line', choices=('word', 'line', 'block'))
+    args = parser.parse_args()
+    labels = load_labels(args.images_dir, args.labels)
+    if not labels:
+        print('No images to benchmark.')
+        return
+    report(run(labels, args.kind), len(labels))
+
+
+if __name__ == '__main__':
+    main()
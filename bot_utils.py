@@ -1,14 +1,29 @@
 # https://github.com/python-telegram-bot/python-telegram-bot/discussions/2876#discussion-3831621
+import asyncio
 import logging
+import os
+import time
 from datetime import datetime as dt
 from io import BytesIO
 import requests as rq
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton  # , ParseMode
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
 
 from screen2text import DictLookup as dlp, tb_logger
+from rate_limiter import OutboundLimiter
+from job_queue import SQLiteJobQueue, DONE, FAILED
 
 results_dict = {}  # store bot recognition results
+limiter = OutboundLimiter()  # all outbound Bot API calls go through it
+
+# when set, recognition is left to ocr_worker.py processes sharing this queue database
+OCR_QUEUE_DB = os.getenv('OCR_QUEUE_DB')
+ocr_queue = SQLiteJobQueue(OCR_QUEUE_DB) if OCR_QUEUE_DB else None
+# seconds to wait for a queued job to be done, enough for a job dropped by its worker to be retried
+# after its lease (60 s by default, see ocr_worker.py) runs out, on each of the attempts allowed
+OCR_WAIT = 300
+OCR_POLL = .5
 
 # https://www.youtube.com/watch?v=9L77QExPmI0
 # TODO: Make it roll
@@ -46,57 +61,102 @@ HINT_MESSAGE = 'Please submit a tightly cropped image of a word in Thai script,
 MAX_LENGTH = 4096
 LOOKUP_TAIL = '...\nclick the link below for more'
 FAILURE = 'something went wrong.'
+LOOKUP_DEADLINE = 20  # seconds the user may be kept waiting for the dictionary
+
+
+async def send_text(message, context, text: str, **kwargs):
+    """
+    Sends a new message to the user through the outbound rate limiter, retrying once in case of initial failure.
+    :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
+    :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
+    :param text: text of the message to be sent.
+    :param kwargs: further keyword arguments for `telegram.Bot.send_message`.
+    :returns: sent message in case of success, None otherwise.
+    """
+    chat_id = message.from_user.id
+    return await dlp.retry_or_none(limiter.call, 2, 1,
+                                   chat_id, context.bot.send_message, chat_id, text,
+                                   **kwargs
+                                   )
+
+
+async def edit_text(context, status, text: str, **kwargs):
+    """
+    Replaces the text of the message through the outbound rate limiter.
+    An edit leaving the message as it was is rejected by the server, but counts as success here.
+    :returns: edited message (or the message as it was if not modified).
+    """
+    try:
+        return await limiter.call(status.chat_id, context.bot.edit_message_text, text,
+                                  chat_id=status.chat_id, message_id=status.message_id,
+                                  **kwargs
+                                  )
+    except BadRequest as e:
+        if 'not modified' in e.message.lower():
+            return status
+        raise
+
 
+async def update_status(message, context, status, text: str, **kwargs):
+    """
+    Replaces the text of the status message in place, so that a single message follows the request through all of
+    its stages. Sends a new message instead if there is no status message to edit yet or it could not be edited.
+    :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
+    :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
+    :param status: previously sent status message or None.
+    :param text: new text of the status message.
+    :param kwargs: further keyword arguments for `telegram.Bot.edit_message_text`.
+    :returns: edited (or sent) message in case of success, None otherwise.
+    """
+    if status:
+        edited = await dlp.retry_or_none(edit_text, 2, 1, context, status, text, **kwargs)
+        if edited:
+            return edited
+        logger.warning(f'status message {status.message_id} could not be edited, sending a new one')
+    return await send_text(message, context, text, **kwargs)
 
-def send_compressed_confirmation(message, context):
+
+async def send_compressed_confirmation(message, context):
     """
     Notifies user that submitted image is compressed and being pulled into the system for processing, retrying once
-    in case of initial failure.
+    in case of initial failure. The message sent serves as status message for the rest of the processing.
     :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
     :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
     :returns: sent message in case of success, None otherwise.
     """
-    sent = dlp.retry_or_none(context.bot.send_message, 2, 1,
-                             message.from_user.id,
-                             'Loading compressed image from server...'
-                             )
+    sent = await send_text(message, context, 'Loading compressed image from server...')
     logger.info('compressed confirmation sent successfully' if sent else FAILURE)
     return sent
 
 
-def send_uncompressed_confirmation(message, context):
+async def send_uncompressed_confirmation(message, context):
     """
     Notifies user that submitted image is being pulled into the system for processing with no compression,
-    retrying once in case of initial failure.
+    retrying once in case of initial failure. The message sent serves as status message for the rest of the processing.
     :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
     :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
     :returns: sent message in case of success, None otherwise.
     """
-    sent = dlp.retry_or_none(context.bot.send_message, 2, 1,
-                             message.from_user.id,
-                             'Loading uncompressed image file from server...'
-                             )
+    sent = await send_text(message, context, 'Loading uncompressed image file from server...')
     logger.info('uncompressed confirmation sent successfully' if sent else FAILURE)
     return sent
 
 
-def send_processing_note(message, context):
+async def send_processing_note(message, context, status=None):
     """
-    Notifies user that submitted image has been successfully loaded and OCR is attempted on it,
-    retrying once in case of initial failure.
+    Notifies user that submitted image has been successfully loaded and OCR is attempted on it by updating
+    the status message, retrying once in case of initial failure.
     :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
     :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
-    :returns: sent message in case of success, None otherwise.
+    :param status: status message to update, a new message is sent if None.
+    :returns: edited (or sent) message in case of success, None otherwise.
     """
-    sent = dlp.retry_or_none(context.bot.send_message, 2, 1,
-                             message.from_user.id,
-                             'File loaded. Attempting recognition...'
-                             )
+    sent = await update_status(message, context, status, 'File loaded. Attempting recognition...')
     logger.info('processing note sent successfully' if sent else FAILURE)
     return sent
 
 
-def send_rejection_note(message, context):
+async def send_rejection_note(message, context):
     """
     Notifies user that submitted object could not be processed due to unsupported type/extension,
     retrying once in case of initial failure.
@@ -105,26 +165,25 @@ def send_rejection_note(message, context):
     :returns: sent message in case of success, None otherwise.
     """
     logger.info('unsupported file extension, sending rejection note...')
-    sent = dlp.retry_or_none(context.bot.send_message, 2, 1,
-                             message.from_user.id,
-                             'File could not be accepted: unexpected type based on extension. '
-                             'Currently supported formats are png and jpg.'
-                             )
+    sent = await send_text(message, context,
+                           'File could not be accepted: unexpected type based on extension. '
+                           'Currently supported formats are png and jpg.'
+                           )
     logger.info(f'rejection note sent successfully to {message.from_user.full_name}' if sent else FAILURE)
     return sent
 
 
-async def send_failure_note(message, context):
+async def send_failure_note(message, context, status=None):
     """
-    Notifies user that requested action could not be successfully accomplished,
-    retrying once in case of initial failure.
+    Notifies user that requested action could not be successfully accomplished, updating the status message
+    if there is one, retrying once in case of initial failure.
     :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
     :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
-    :returns: sent message in case of success, None otherwise.
+    :param status: status message to update, a new message is sent if None.
+    :returns: edited (or sent) message in case of success, None otherwise.
     """
-    sent = await dlp.retry_or_none(
-        context.bot.send_message, 2, 1,
-        message.from_user.id,
+    sent = await update_status(
+        message, context, status,
         'Something went wrong... Please consider trying one more time '
         'or notifying @jornjat the maintainer if the error persists.'
     )
@@ -132,13 +191,14 @@ async def send_failure_note(message, context):
     return sent
 
 
-async def do_recognize(r: rq.Response, message, context) -> list[tuple[str, float]]:
+async def do_recognize(r: rq.Response, message, context, status=None) -> list[tuple[str, float]]:
     """
     Pulls response content into PIL Image object, runs recognition and generates suggestions with
     provisional confidence rating as a list of tuples.
     :param r: response object obtained from call to the telegram API using requests library.
     :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
     :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
+    :param status: status message to keep the user posted through, a new message is sent if None.
     :return: a list of rated suggestions as tuples or empty list in case of failure.
     """
     x = dlp()
@@ -149,7 +209,9 @@ async def do_recognize(r: rq.Response, message, context) -> list[tuple[str, floa
         tb_logger.exception(e)
         return []
     logger.info('initiating recognition...')
-    await send_processing_note(message, context)
+    await send_processing_note(message, context, status)
+    if ocr_queue:
+        return await queued_recognize(r.content)
     try:
         x.threads_recognize(lang='tha', kind='line')
     except Exception as e:
@@ -161,6 +223,39 @@ async def do_recognize(r: rq.Response, message, context) -> list[tuple[str, floa
     return x.suggestions
 
 
+async def queued_recognize(image: bytes, lang='tha', kind='line') -> list[tuple[str, float]]:
+    """
+    Puts the image on the OCR job queue and waits for one of the workers to get it done.
+    :param image: image file content.
+    :param lang: recognition language as understood by Tesseract.
+    :param kind: kind of text on the image as understood by `threads_recognize`.
+    :return: a list of rated suggestions as tuples or empty list in case of failure.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        job_id = await loop.run_in_executor(None, ocr_queue.put, image, lang, kind)
+    except Exception as e:
+        logger.error(f"couldn't enqueue recognition job: {e}")
+        tb_logger.exception(e)
+        return []
+    logger.info(f'recognition job {job_id} queued')
+    deadline = time.monotonic() + OCR_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(OCR_POLL)
+        job = await dlp.retry_or_none(ocr_queue.fetch, 2, OCR_POLL, job_id, False)
+        if not job or job.status not in (DONE, FAILED):
+            continue
+        await loop.run_in_executor(None, ocr_queue.remove, job_id)
+        if job.status == FAILED:
+            logger.error(f'recognition job {job_id} failed: {job.error}')
+            return []
+        logger.info(f'recognition job {job_id} produced {len(job.result)} suggestion(s)')
+        return [tuple(item) for item in job.result]
+    logger.error(f'recognition job {job_id} not done in {OCR_WAIT} s, withdrawing it')
+    await dlp.retry_or_none(ocr_queue.remove, 2, OCR_POLL, job_id)
+    return []
+
+
 def generate_choices(suggestions: list[tuple[str, float]]) -> str:
     """
     Builds a message with numbered suggested recognition results for user to choose which one to look up
@@ -177,20 +272,18 @@ def generate_choices(suggestions: list[tuple[str, float]]) -> str:
     return choices
 
 
-def send_choices(message, context, choices: str):
+async def send_choices(message, context, choices: str, status=None):
     """
-    Sends the message with numbered suggested recognition results for user to choose which one to look up
-    or informs them of ultimate failure to produce any.
+    Turns the status message into the one with numbered suggested recognition results for user to choose which one
+    to look up or informs them of ultimate failure to produce any.
     :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
     :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
     :param choices: text of the message to be sent.
-    :returns: sent message in case of success, None otherwise.
+    :param status: status message to update, a new message is sent if None.
+    :returns: edited (or sent) message in case of success, None otherwise.
     """
     logger.info(f'sending choices to {message.from_user.full_name}')
-    sent = dlp.retry_or_none(context.bot.send_message, 2, 1,
-                             message.from_user.id,
-                             choices
-                             )
+    sent = await update_status(message, context, status, choices)
     logger.info('choices sent successfully' if sent else FAILURE)
     return sent
 
@@ -218,33 +311,63 @@ def obtain_query(message) -> str:
 
 async def do_lookup(message, context, query: str):
     """
-    Performs lookup for the query in online dictionary, prepares resulting output and sends it to user as
-    formatted markdown or plain text as a fallback option.
+    Performs lookup for the query, answering right away from the local dictionary tier if it knows the query and
+    enriching the answer from the online dictionary in the background, or otherwise waiting for the online
+    dictionary with a notification in place of which the results are sent.
     :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
     :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
     :param query: a text to look up.
     :return: sent message if anything managed to get through (albeit failure note) or None in case of ultimate failure.
     """
     logger.info(f'got a text to look up, initiating lookup for {query}')
-    sent = await dlp.retry_or_none(context.bot.send_message, 2, 1,
-                             message.from_user.id,
-                             f'looking up {query} ...'
-                             )
-    logger.info(f'notification sent successfully to {message.from_user.full_name}' if sent else FAILURE)
     x = dlp()
-    if not await x.lookup(query):
-        return await send_failure_note(message, context)
+    if x.local_lookup(query):
+        status = await send_text(message, context, trim_output(x.output_local_markdown()),
+                                 parse_mode=ParseMode.MARKDOWN
+                                 ) or await send_text(message, context, trim_output(x.output_local_plain()))
+        logger.info(f'local results sent successfully to {message.from_user.full_name}' if status else FAILURE)
+        context.application.create_task(enrich_lookup(message, context, x, query, status))
+        return status
+    status = await send_text(message, context, f'looking up {query} ...')
+    logger.info(f'notification sent successfully to {message.from_user.full_name}' if status else FAILURE)
+    return await online_lookup(message, context, x, query, status)
+
+
+async def enrich_lookup(message, context, x: dlp, query: str, status):
+    """
+    Background continuation of `do_lookup` replacing the local results with those from the online dictionary,
+    which are left as they are if the online dictionary fails.
+    """
+    try:
+        await online_lookup(message, context, x, query, status)
+    except Exception as e:
+        logger.error(f'enriching lookup for {query} failed: {e}')
+        tb_logger.exception(e)
+
+
+async def online_lookup(message, context, x: dlp, query: str, status):
+    """
+    Performs lookup for the query in online dictionary, prepares resulting output and sends it to user as
+    formatted markdown or plain text as a fallback option, in place of the status message.
+    Failure note is only sent if there are no local results already shown to the user.
+    :param message: instance attribute message of telegram.update.Update extracted from the initiating update.
+    :param context: instance of telegram.ext.CallbackContext containing the running Bot as a property.
+    :param x: DictLookup instance, possibly holding local results for the query.
+    :param query: a text to look up.
+    :param status: status message to update, a new message is sent if None.
+    :return: sent message if anything managed to get through (albeit failure note) or None in case of ultimate failure.
+    """
+    if not await x.lookup(query, time.monotonic() + LOOKUP_DEADLINE):
+        if x.entries:
+            logger.info(f'online dictionary unavailable, local results for {query} stay')
+            return await settle_local(message, context, x, status)
+        return await send_failure_note(message, context, status)
     output = trim_output(x.output_markdown())
     logger.info(
         f'markdown output generated ({output[:128] if len(output) > 128 else output} ...)'
         .replace('\n', ' ')
     )
-    sent = await dlp.retry_or_none(
-        context.bot.send_message, 2, 1,
-        message.from_user.id,
-        output,
-        parse_mode=ParseMode.MARKDOWN
-    )
+    sent = await update_status(message, context, status, output, parse_mode=ParseMode.MARKDOWN)
     logger.info(f'and sent successfully to {message.from_user.full_name}' if sent else FAILURE)
     if not sent:
         output = trim_output(x.output_plain())
@@ -252,17 +375,28 @@ async def do_lookup(message, context, query: str):
             f'plain output generated ({output[:128] if len(output) > 128 else output} ...)'
             .replace('\n', ' ')
         )
-        sent = await dlp.retry_or_none(context.bot.send_message, 2, 1,
-                                 message.from_user.id,
-                                 output,
-                                 timeout=15
-                                 )
+        sent = await update_status(message, context, status, output)
         logger.info(f'and sent successfully to {message.from_user.full_name}' if sent else FAILURE)
+    if not sent and x.entries:
+        return await settle_local(message, context, x, status)
     if not sent:
-        await send_failure_note(message, context)
+        await send_failure_note(message, context, status)
     return sent
 
 
+async def settle_local(message, context, x: dlp, status):
+    """
+    Rewrites the local results shown to the user so they no longer promise more from the online dictionary.
+    :return: edited message, or the status message as it was if editing fails.
+    """
+    sent = await update_status(message, context, status, trim_output(x.output_local_markdown(fetching=False)),
+                               parse_mode=ParseMode.MARKDOWN
+                               ) or await update_status(message, context, status,
+                                                        trim_output(x.output_local_plain(fetching=False)))
+    logger.info(f'local results settled for {message.from_user.full_name}' if sent else FAILURE)
+    return sent or status
+
+
 def trim_output(output: str) -> str:
     """
     Checks if the output text size exceeds the maximum length allowed by Telegram and, if true, trims it neatly to the
@@ -278,7 +412,7 @@ def trim_output(output: str) -> str:
     return output
 
 
-def send_hint(message, context):
+async def send_hint(message, context):
     """
     In case no action could be taken based on the incoming message, sends user a hint on how to use the service,
     retrying once on initial failure.
@@ -287,16 +421,12 @@ def send_hint(message, context):
     :returns: sent message in case of success, None otherwise.
     """
     logger.info('no meaningful action could be taken based on the message text, sending hint...')
-    sent = dlp.retry_or_none(context.bot.send_message, 2, 1,
-                             message.from_user.id,
-                             HINT_MESSAGE,
-                             parse_mode=ParseMode.MARKDOWN
-                             )
+    sent = await send_text(message, context, HINT_MESSAGE, parse_mode=ParseMode.MARKDOWN)
     logger.info(f'hint message sent to {message.from_user.full_name}' if sent else FAILURE)
     return sent
 
 
-def send_baffled(message, context):
+async def send_baffled(message, context):
     """
     In case incoming message cannot be parsed in any meaningful way, sends the user a request for clarification,
     retrying once on initial failure.
@@ -305,9 +435,6 @@ def send_baffled(message, context):
     :returns: sent message in case of success, None otherwise.
     """
     logger.info(f'unknown matter encountered in the message, sending baffled note...')
-    sent = dlp.retry_or_none(context.bot.send_message, 2, 1,
-                             message.from_user.id,
-                             'What is it?'
-                             )
+    sent = await send_text(message, context, 'What is it?')
     logger.info('sent successfully' if sent else FAILURE)
     return sent
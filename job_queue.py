@@ -0,0 +1,224 @@
+import json
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from typing import NamedTuple
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+class Job(NamedTuple):
+    id: int
+    status: str
+    image: bytes
+    lang: str
+    kind: str | None
+    attempts: int
+    result: list | None
+    error: str | None
+
+
+class JobQueue(ABC):
+    """
+    Durable queue of OCR jobs shared by the bot (producer) and any number of OCR workers (consumers).
+    A worker claims a job for a limited lease; jobs whose lease runs out without completion (e.g. the worker died)
+    become claimable again, until the allowed number of attempts is exhausted.
+    This class defines the interface only, implementations may keep the jobs locally (see `SQLiteJobQueue`)
+    or with a networked broker reachable from several hosts.
+    """
+
+    @abstractmethod
+    def put(self, image: bytes, lang: str = 'tha', kind: str | None = None) -> int:
+        """
+        Enqueues an image for recognition.
+        :return: id of the job created.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def claim(self, worker: str, lease: float) -> Job | None:
+        """
+        Hands the oldest claimable job over to the worker for :lease: seconds.
+        :return: the claimed job or None if there is nothing to do.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def complete(self, job_id: int, worker: str, result: list) -> bool:
+        """
+        Stores the recognition result of a job claimed by the worker, marking it done.
+        :return: False if the job is no longer held by the worker (its lease expired and it was claimed again,
+        or it was removed), in which case nothing is changed.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """
+        Releases a job claimed by the worker for another attempt or marks it failed if no attempts are left.
+        :return: False if the job is no longer held by the worker, in which case nothing is changed.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def renew(self, job_id: int, worker: str, lease: float) -> bool:
+        """
+        Extends the lease of a job claimed by the worker to :lease: seconds from now, for workers to keep their jobs
+        for as long as they are working on them while a short lease lets jobs of dead workers be retried soon.
+        :return: False if the job is no longer held by the worker.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def fetch(self, job_id: int, with_image: bool = True) -> Job | None:
+        """
+        :param with_image: whether to load the image too, not needed to check on the job.
+        :return: current state of the job or None if there is no such job.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove(self, job_id: int):
+        """Forgets the job, once its result has been collected or is no longer wanted."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def purge(self, older_than: float) -> int:
+        """
+        Forgets finished (done or failed) jobs nobody collected for :older_than: seconds.
+        :return: number of jobs removed.
+        """
+        raise NotImplementedError
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    `JobQueue` kept in a SQLite database file, suitable for the bot and workers running on the same host.
+    A new connection is opened for every operation, so a single instance can be shared between threads.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        with self.connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, status TEXT, image BLOB, lang TEXT, '
+                'kind TEXT, attempts INTEGER DEFAULT 0, worker TEXT, lease_until REAL, result TEXT, error TEXT, '
+                'created REAL, updated REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)')
+        conn.close()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA busy_timeout=30000')
+        return conn
+
+    def put(self, image, lang='tha', kind=None):
+        conn = self.connect()
+        try:
+            now = time.time()
+            cur = conn.execute(
+                'INSERT INTO jobs (status, image, lang, kind, created, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                (PENDING, image, lang, kind, now, now)
+            )
+            return cur.lastrowid
+        finally:
+            conn.close()
+
+    def claim(self, worker, lease):
+        conn = self.connect()
+        try:
+            now = time.time()
+            conn.execute('BEGIN IMMEDIATE')
+            # jobs abandoned by their workers with no attempts left are given up on
+            conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, image = NULL, updated = ? '
+                'WHERE status = ? AND lease_until < ? AND attempts >= ?',
+                (FAILED, 'lease expired', now, RUNNING, now, self.max_attempts)
+            )
+            row = conn.execute(
+                'SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY id LIMIT 1',
+                (PENDING, RUNNING, now)
+            ).fetchone()
+            if not row:
+                conn.execute('COMMIT')
+                return None
+            claimed = conn.execute(
+                'UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? '
+                'WHERE id = ? AND (status = ? OR (status = ? AND lease_until < ?))',
+                (RUNNING, worker, now + lease, now, row[0], PENDING, RUNNING, now)
+            ).rowcount
+            conn.execute('COMMIT')
+            return self.fetch(row[0]) if claimed else None
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def complete(self, job_id, worker, result):
+        conn = self.connect()
+        try:
+            return conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, image = NULL, updated = ? '
+                'WHERE id = ? AND status = ? AND worker = ?',
+                (DONE, json.dumps(result, ensure_ascii=False), time.time(), job_id, RUNNING, worker)
+            ).rowcount > 0
+        finally:
+            conn.close()
+
+    def fail(self, job_id, worker, error):
+        conn = self.connect()
+        try:
+            return conn.execute(
+                'UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, '
+                'image = CASE WHEN attempts >= ? THEN NULL ELSE image END, '
+                'error = ?, lease_until = NULL, updated = ? WHERE id = ? AND status = ? AND worker = ?',
+                (self.max_attempts, FAILED, PENDING, self.max_attempts, error, time.time(), job_id, RUNNING, worker)
+            ).rowcount > 0
+        finally:
+            conn.close()
+
+    def renew(self, job_id, worker, lease):
+        conn = self.connect()
+        try:
+            now = time.time()
+            return conn.execute(
+                'UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND status = ? AND worker = ?',
+                (now + lease, now, job_id, RUNNING, worker)
+            ).rowcount > 0
+        finally:
+            conn.close()
+
+    def fetch(self, job_id, with_image=True):
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                f'SELECT id, status, {"image" if with_image else "NULL"}, lang, kind, attempts, result, error '
+                'FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        job_id, status, image, lang, kind, attempts, result, error = row
+        return Job(job_id, status, image, lang, kind, attempts, json.loads(result) if result else None, error)
+
+    def remove(self, job_id):
+        conn = self.connect()
+        try:
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        finally:
+            conn.close()
+
+    def purge(self, older_than):
+        conn = self.connect()
+        try:
+            return conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?', (DONE, FAILED, time.time() - older_than)
+            ).rowcount
+        finally:
+            conn.close()
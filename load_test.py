@@ -0,0 +1,331 @@
+"""
+End-to-end load test running the real bot handlers against a local fake Telegram Bot API
+and a stub Longdo Dictionary server, with N simulated users going through the photo, suggestion number
+and lookup flows. Reports throughput, latency percentiles per flow, event loop lag and memory growth.
+
+usage: python load_test.py [--users 10] [--rounds 3] [--image word.png | --font thai.ttf] [--pages recorded/]
+                           [--dict-latency 0.5] [--dict-jitter 0.2] [--dict-error-rate 0] [--concurrent]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, unquote, urlparse
+
+from PIL import Image, ImageDraw, ImageFont
+from telegram.ext import ApplicationBuilder
+
+import main as bot
+from bot_utils import dlp, HINT_MESSAGE
+
+TOKEN = '123456:LOAD-TEST'
+PROGRESS_PREFIXES = ('Loading', 'File loaded', 'looking up')  # anything else sent to a user completes a flow
+FAILURE_PREFIX = 'Something went wrong'
+# replies completing a flow without doing what the flow is about
+FAILURE_REPLIES = {
+    'photo': (FAILURE_PREFIX, 'No meaningful recognition results'),
+    'number': (FAILURE_PREFIX, HINT_MESSAGE),  # the hint means the suggestions of the photo were not there
+    'lookup': (FAILURE_PREFIX,),
+}
+LOOKUP_WORDS = ('เกล้า', 'ภาษา', 'หนังสือ', 'แมว', 'น้ำ')
+PHOTO_WORD = 'ภาษา'
+THAI_FONTS = ('/usr/share/fonts/truetype/tlwg/Garuda.ttf', '/usr/share/fonts/truetype/tlwg/Loma.ttf',
+              '/usr/share/fonts/truetype/noto/NotoSansThai-Regular.ttf',
+              '/usr/share/fonts/noto/NotoSansThai-Regular.ttf', 'C:/Windows/Fonts/tahoma.ttf')
+DEFAULT_PAGE = '''<html><body>
+<table><tr><td class="search-table-header">NECTEC Lexitron Dictionary EN-TH</td></tr></table>
+<table class="search-result-table"><tr><td>{word}</td><td>stub definition of {word}</td></tr></table>
+</body></html>'''
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class FakeTelegram:
+    """
+    Bot API look-alike serving queued updates through getUpdates and the image through file downloads,
+    and telling the waiting simulated users whenever the bot sends or edits a message addressed to them.
+    """
+
+    def __init__(self, image: bytes, loop: asyncio.AbstractEventLoop):
+        self.image = image
+        self.loop = loop
+        self.updates = []
+        self.update_id = 0
+        self.message_id = 0
+        self.condition = threading.Condition()
+        # user id -> future resolved with the text completing the current flow and ids of messages sent during it,
+        # so that late edits belonging to an earlier flow (e.g. background lookup enrichment) are not mistaken for it
+        self.waiting: dict[int, tuple[asyncio.Future, set]] = {}
+        self.calls: dict[str, int] = {}
+
+    def push(self, user_id: int, **content) -> asyncio.Future:
+        future = self.loop.create_future()
+        with self.condition:
+            self.update_id += 1
+            self.message_id += 1
+            user = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+            message = {'message_id': self.message_id, 'date': int(time.time()),
+                       'chat': {'id': user_id, 'type': 'private'}, 'from': user, **content}
+            self.waiting[user_id] = (future, set())
+            self.updates.append({'update_id': self.update_id, 'message': message})
+            self.condition.notify_all()
+        return future
+
+    def get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        with self.condition:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            if not self.updates:
+                self.condition.wait(timeout)
+            return list(self.updates)
+
+    def deliver(self, chat_id: int, message_id: int, text: str, edit: bool):
+        with self.condition:
+            future, sent_ids = self.waiting.get(chat_id, (None, set()))
+            if not future or (edit and message_id not in sent_ids):
+                return
+            sent_ids.add(message_id)
+            if text.startswith(PROGRESS_PREFIXES):
+                return
+            del self.waiting[chat_id]
+        self.loop.call_soon_threadsafe(lambda: future.done() or future.set_result(text))
+
+    def message(self, params, edit=False):
+        with self.condition:
+            self.message_id += 1
+            message_id = int(params['message_id']) if edit else self.message_id
+        chat_id = int(params['chat_id'])
+        self.deliver(chat_id, message_id, params.get('text', ''), edit)
+        return {'message_id': message_id, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+
+    def handle(self, method, params):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'load_test_bot'}
+        if method == 'getUpdates':
+            return self.get_updates(params)
+        if method in ('sendMessage', 'editMessageText'):
+            return self.message(params, edit=method == 'editMessageText')
+        if method == 'getFile':
+            return {'file_id': params['file_id'], 'file_unique_id': params['file_id'], 'file_size': len(self.image),
+                    'file_path': f'photos/{params["file_id"]}.png'}
+        return True
+
+    def server(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body, content_type='application/json'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if '/file/' in self.path:
+                    return self.reply(200, fake.image, 'image/png')
+                self.do_POST()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode('utf-8') if length else ''
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body or '{}')
+                else:
+                    params = {key: values[0] for key, values in parse_qs(body).items()}
+                method = urlparse(self.path).path.rstrip('/').split('/')[-1]
+                result = fake.handle(method, params)
+                self.reply(200, json.dumps({'ok': True, 'result': result}).encode('utf-8'))
+
+        return ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+
+
+class StubLongdo:
+    """
+    Dictionary server replaying recorded pages (<word>.html in the pages directory) with configurable latency.
+    """
+
+    def __init__(self, pages_dir=None, latency=.5, jitter=.2, error_rate=0.0):
+        self.pages_dir = pages_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def page(self, word):
+        if self.pages_dir:
+            try:
+                with open(f'{self.pages_dir}/{word}.html', encoding='utf-8') as f:
+                    return f.read()
+            except FileNotFoundError:
+                pass
+        return DEFAULT_PAGE.format(word=word)
+
+    def server(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                time.sleep(max(0.0, stub.latency + random.uniform(-stub.jitter, stub.jitter)))
+                if random.random() < stub.error_rate:
+                    status, body = 503, b'unavailable'
+                else:
+                    status, body = 200, stub.page(unquote(urlparse(self.path).path.split('/')[-1])).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+async def watch_loop_lag(lags, interval=.05):
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        lags.append(time.monotonic() - start - interval)
+
+
+async def simulate_user(fake, user_id, rounds, timeout, results):
+    flows = [
+        ('photo', lambda: {'photo': [{'file_id': f'p{user_id}', 'file_unique_id': f'p{user_id}',
+                                      'width': 200, 'height': 50}]}),
+        ('number', lambda: {'text': '0'}),
+        ('lookup', lambda: {'text': f'lookup {random.choice(LOOKUP_WORDS)}'}),
+    ]
+    for _ in range(rounds):
+        for flow, content in flows:
+            start = time.monotonic()
+            try:
+                text = await asyncio.wait_for(fake.push(user_id, **content()), timeout)
+            except asyncio.TimeoutError:
+                results.append((flow, None, 'timeout'))
+                continue
+            outcome = 'failure' if text.startswith(FAILURE_REPLIES[flow]) else 'ok'
+            results.append((flow, time.monotonic() - start, outcome))
+
+
+def report(results, lags, elapsed, memory, calls):
+    print(f'\n{len(results)} flow(s) in {elapsed:.1f} s, {len(results) / elapsed:.2f} flows/s')
+    print(f'{"flow":<8}{"count":>7}{"ok":>6}{"fail":>6}{"t/o":>6}{"p50":>8}{"p95":>8}{"p99":>8}')
+    for flow in ('photo', 'number', 'lookup'):
+        rows = [row for row in results if row[0] == flow]
+        latencies = [row[1] for row in rows if row[1] is not None]
+        counts = {outcome: sum(row[2] == outcome for row in rows) for outcome in ('ok', 'failure', 'timeout')}
+        print(f'{flow:<8}{len(rows):>7}{counts["ok"]:>6}{counts["failure"]:>6}{counts["timeout"]:>6}'
+              f'{percentile(latencies, .5):>8.2f}{percentile(latencies, .95):>8.2f}{percentile(latencies, .99):>8.2f}')
+    print(f'\nevent loop lag: p50 {percentile(lags, .5) * 1000:.1f} ms, p99 {percentile(lags, .99) * 1000:.1f} ms, '
+          f'max {max(lags, default=0) * 1000:.1f} ms')
+    start, end, peak, rss = memory
+    print(f'traced memory: {start / 2 ** 20:.1f} -> {end / 2 ** 20:.1f} MiB (peak {peak / 2 ** 20:.1f} MiB), '
+          f'max RSS {rss / 1024:.1f} MiB')
+    print('Bot API calls: ' + ', '.join(f'{method} {count}' for method, count in sorted(calls.items())))
+
+
+def load_image(path, font_path=None):
+    """
+    :return: content of the image file supplied or of an image of a Thai word rendered with the font supplied
+    or any of the common Thai fonts found.
+    """
+    if path:
+        with open(path, 'rb') as f:
+            return f.read()
+    font_path = font_path or next((path for path in THAI_FONTS if os.path.exists(path)), None)
+    if not font_path:
+        raise SystemExit('no Thai font found to render the photo with, please supply --image or --font')
+    font = ImageFont.truetype(font_path, 48)
+    left, top, right, bottom = font.getbbox(PHOTO_WORD)
+    im = Image.new('L', (right - left + 20, bottom - top + 20), 255)
+    ImageDraw.Draw(im).text((10 - left, 10 - top), PHOTO_WORD, font=font, fill=0)
+    buffer = BytesIO()
+    im.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def check_image(image: bytes):
+    """Makes sure the photo flow has suggestions to offer, or the number flows measure nothing but hints."""
+    x = dlp()
+    x.load_image(BytesIO(image))
+    x.threads_recognize(lang='tha', kind='line')
+    x.generate_word_suggestions()
+    if not x.suggestions:
+        raise SystemExit('no suggestions could be produced from the photo, please supply another --image')
+    print(f'photo yields {len(x.suggestions)} suggestion(s), leading with {x.suggestions[0][0]}')
+
+
+async def run(args):
+    image = load_image(args.image, args.font)
+    check_image(image)
+    fake = FakeTelegram(image, asyncio.get_running_loop())
+    telegram_url = serve(fake.server())
+    dlp.dic_url = serve(StubLongdo(args.pages, args.dict_latency, args.dict_jitter, args.dict_error_rate).server()
+                        ) + '/search/'
+    builder = ApplicationBuilder().token(TOKEN).base_url(f'{telegram_url}/bot').base_file_url(f'{telegram_url}/file/bot')
+    if args.concurrent:
+        builder = builder.concurrent_updates(True)
+    app = bot.build_app(builder)
+
+    lags = []
+    results = []
+    tracemalloc.start()
+    memory_start = tracemalloc.get_traced_memory()[0]
+    async with app:
+        await app.start()
+        await app.updater.start_polling(poll_interval=0, timeout=1)
+        lag_watcher = asyncio.create_task(watch_loop_lag(lags))
+        start = time.monotonic()
+        await asyncio.gather(*(
+            simulate_user(fake, 1000 + i, args.rounds, args.flow_timeout, results) for i in range(args.users)
+        ))
+        elapsed = time.monotonic() - start
+        lag_watcher.cancel()
+        await app.updater.stop()
+        await app.stop()
+    memory_end, memory_peak = tracemalloc.get_traced_memory()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report(results, lags, elapsed, (memory_start, memory_end, memory_peak, rss), fake.calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the bot against fake Telegram and dictionary servers.')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=3, help='times each user goes through all the flows')
+    parser.add_argument('--image', help='image of Thai text to send as photo, rendered with --font by default')
+    parser.add_argument('--font', help='Thai font to render the photo with, one of the common ones by default')
+    parser.add_argument('--pages', help='directory of recorded dictionary pages named <word>.html')
+    parser.add_argument('--dict-latency', type=float, default=.5)
+    parser.add_argument('--dict-jitter', type=float, default=.2)
+    parser.add_argument('--dict-error-rate', type=float, default=0.0)
+    parser.add_argument('--flow-timeout', type=float, default=120)
+    parser.add_argument('--concurrent', action='store_true', help='let the application handle updates concurrently')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
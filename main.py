@@ -15,18 +15,14 @@ from telegram.ext import (
 # from dotenv import load_dotenv
 
 from bot_utils import *
-from auth import *
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info(f'/start command issued by {update.effective_user.full_name}')
-    try:
-        await update.message.reply_text(
-            START_MESSAGE,
-            parse_mode=ParseMode.MARKDOWN
-        )
+    sent = await send_text(update.message, context, START_MESSAGE, parse_mode=ParseMode.MARKDOWN)
+    if sent:
         logger.info(f'start message sent to {update.effective_user.full_name}')
-    except Exception as e:
-        logger.warning(f'failed sending start message to {update.effective_user.full_name}: {e}')
+    else:
+        logger.warning(f'failed sending start message to {update.effective_user.full_name}')
         await send_failure_note(update.message, context)
 
 
@@ -41,27 +37,28 @@ async def service(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             await send_hint(message, context)
     elif message.photo or message.document:
         file = None
+        status = None  # single message updated in place as the image goes through the pipeline
         if message.photo:
             logger.info(f'incoming photo from {update.effective_user.full_name} detected by service handler.')
-            file = await context.bot.get_file(message.photo[0].file_id)
-            await send_compressed_confirmation(message, context)
+            file = await limiter.call(None, context.bot.get_file, message.photo[0].file_id)
+            status = await send_compressed_confirmation(message, context)
         elif message.document:
             logger.info(f'incoming file from {update.effective_user.full_name} detected by service handler.')
-            file = await context.bot.get_file(message.document.file_id)
+            file = await limiter.call(None, context.bot.get_file, message.document.file_id)
             if file.file_path.endswith('.png') or file.file_path.endswith('.jpg'):
-                await send_uncompressed_confirmation(message, context)
+                status = await send_uncompressed_confirmation(message, context)
             else:
                 await send_rejection_note(message, context)
                 return
         logger.info(f'loading {file.file_path}')
         r = await dlp.retry_or_none(rq.get, 3, 1, file.file_path, timeout=30)
         if not r:
-            await send_failure_note(message, context)
+            await send_failure_note(message, context, status)
             return
-        results_dict[message.from_user.id] = await do_recognize(r, message, context)  # TODO: catch exception, notify user
+        results_dict[message.from_user.id] = await do_recognize(r, message, context, status)  # TODO: catch exception, notify user
         suggestions = results_dict[message.from_user.id]
         choices = generate_choices(suggestions)
-        await send_choices(message, context, choices)
+        await send_choices(message, context, choices, status)
         return
     else:
         await send_baffled(message, context)
@@ -80,14 +77,24 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await send_failure_note(message, context)
     
 
-def main() -> None:
-    app = ApplicationBuilder().token(TOKEN).read_timeout(15).build()
+def build_app(builder: ApplicationBuilder):
+    """
+    Completes the supplied builder (already given the token and any connection settings) into
+    the Application with all the handlers registered.
+    """
+    app = builder.read_timeout(15).build()
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("error", simulated_error))
     app.add_handler(MessageHandler(filters.ALL, service))
 
     app.add_error_handler(error_handler)
+    return app
+
+
+def main() -> None:
+    from auth import TOKEN
+    app = build_app(ApplicationBuilder().token(TOKEN))
 
     app.run_polling()
 
@@ -0,0 +1,88 @@
+"""
+OCR worker taking recognition jobs off the queue filled by the bot running with OCR_QUEUE_DB set.
+Any number of workers can be run side by side to scale recognition independently of the bot.
+
+usage: python ocr_worker.py [--db resources/ocr_jobs.db] [--lease 60] [--poll 0.5] [--retention 3600]
+"""
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime as dt
+from io import BytesIO
+
+from job_queue import SQLiteJobQueue
+from screen2text import ClipImg2Text, tb_logger
+
+logging.basicConfig(format='%(asctime)s [%(name)s] %(levelname)s: %(message)s',
+                    filename=f'logs/ocr_worker_{dt.now():%Y%m%d-%H%M%S}_{os.getpid()}.log', encoding='utf-8',
+                    level=logging.INFO)
+logger = logging.getLogger('ocr_worker')
+
+
+def recognize(job) -> list[tuple[str, float]]:
+    x = ClipImg2Text()
+    x.load_image(BytesIO(job.image))
+    x.threads_recognize(lang=job.lang, kind=job.kind)
+    x.generate_word_suggestions()
+    return x.suggestions
+
+
+def keep_leased(queue, job_id: int, worker: str, lease: float, done: threading.Event):
+    """Renews the lease of the job every third of it until :done: is set, so that only dead workers lose jobs."""
+    while not done.wait(lease / 3):
+        if not queue.renew(job_id, worker, lease):
+            logger.warning(f'job {job_id} no longer held by this worker, lease not renewed')
+            return
+
+
+def work(queue, worker: str, lease: float, poll: float, retention: float):
+    logger.info(f'worker {worker} started on {queue.path}')
+    purged_at = 0.0
+    while True:
+        job = queue.claim(worker, lease)
+        if not job:
+            if time.monotonic() - purged_at > retention:
+                purged_at = time.monotonic()
+                purged = queue.purge(retention)
+                if purged:
+                    logger.info(f'{purged} uncollected job(s) purged')
+            time.sleep(poll)
+            continue
+        logger.info(f'job {job.id} claimed (attempt {job.attempts})')
+        done = threading.Event()
+        renewer = threading.Thread(target=keep_leased, args=(queue, job.id, worker, lease, done), daemon=True)
+        renewer.start()
+        try:
+            suggestions = recognize(job)
+        except Exception as e:
+            logger.error(f'job {job.id} failed: {e}')
+            tb_logger.exception(e)
+            if not queue.fail(job.id, worker, str(e)):
+                logger.warning(f'job {job.id} no longer held by this worker, failure discarded')
+            continue
+        finally:
+            done.set()
+            renewer.join()
+        if queue.complete(job.id, worker, suggestions):
+            logger.info(f'job {job.id} done with {len(suggestions)} suggestion(s)')
+        else:
+            logger.warning(f'job {job.id} no longer held by this worker, result discarded')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run an OCR worker fed by the bot job queue.')
+    parser.add_argument('--db', default=os.getenv('OCR_QUEUE_DB', 'resources/ocr_jobs.db'))
+    parser.add_argument('--lease', type=float, default=60,
+                        help='seconds a claimed job stays reserved without being renewed, i.e. after a worker dies')
+    parser.add_argument('--poll', type=float, default=.5, help='seconds to wait when the queue is empty')
+    parser.add_argument('--retention', type=float, default=3600,
+                        help='seconds finished jobs are kept for the bot to collect')
+    args = parser.parse_args()
+    work(SQLiteJobQueue(args.db), f'{socket.gethostname()}:{os.getpid()}', args.lease, args.poll, args.retention)
+
+
+if __name__ == '__main__':
+    main()
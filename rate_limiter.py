@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Any
+
+from telegram.error import RetryAfter
+
+from screen2text import tb_logger
+
+logger = logging.getLogger(__name__)
+
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+GLOBAL_RATE = 30  # messages per second across all chats
+CHAT_RATE = 1  # messages per second within a single chat
+CHAT_BURST = 3  # short bursts within a chat are tolerated
+MAX_CHAT_BUCKETS = 1000
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to `capacity` tokens, refilled continuously at `rate` tokens per second.
+    Can additionally be blocked until a given moment, as requested by the server in a 429 response.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """
+        Takes a token, running into debt if there is none, so that tokens are handed out in the order of reservation.
+        :return: seconds to wait before the reserved token is actually available, 0 if right away.
+        """
+        self.refill(now)
+        self.tokens -= 1
+        return max(self.blocked_until - now, -self.tokens / self.rate, 0)
+
+    def release(self):
+        """Gives back a reserved token that will not be used."""
+        self.tokens += 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class OutboundLimiter:
+    """
+    Throttles outbound Bot API calls with a global token bucket and one bucket per chat,
+    backing off for as long as the server asks whenever it responds with 429 Too Many Requests.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE, chat_burst: float = CHAT_BURST):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets: dict[int, TokenBucket] = {}
+
+    def chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        if chat_id not in self.chat_buckets and len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+            self.chat_buckets = {key: bucket for key, bucket in self.chat_buckets.items() if not bucket.is_idle(now)}
+        return self.chat_buckets.setdefault(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+
+    async def acquire(self, chat_id: int | None = None):
+        """
+        Reserves a token in the global bucket and in the bucket of the chat (if any) and waits until both are due,
+        so that calls go out in the order they arrived in.
+        :param chat_id: id of the chat the call is addressed to, None for calls not bound to a chat (e.g. getFile).
+        """
+        now = time.monotonic()
+        buckets = [self.global_bucket]
+        if chat_id is not None:
+            buckets.append(self.chat_bucket(chat_id, now))
+        wait = max(bucket.reserve(now) for bucket in buckets)
+        try:
+            while wait > 0:
+                await asyncio.sleep(wait)
+                # the server may have asked to back off in the meantime
+                wait = max(bucket.blocked_until for bucket in buckets) - time.monotonic()
+        except asyncio.CancelledError:
+            for bucket in buckets:
+                bucket.release()
+            raise
+
+    def back_off(self, seconds: float, chat_id: int | None = None):
+        """
+        Blocks the chat bucket (or the global one for calls not bound to a chat) for the given number of seconds.
+        """
+        if chat_id is None:
+            self.global_bucket.block(seconds)
+        else:
+            self.chat_bucket(chat_id, time.monotonic()).block(seconds)
+
+    async def call(self, chat_id: int | None, func, *args, flood_attempts: int = 3, **kwargs) -> Any:
+        """
+        Awaits the supplied Bot API coroutine function once the rate limits allow, repeating the call
+        after the requested delay if flood control kicks in. Any other exception is propagated to the caller.
+        :param chat_id: id of the chat the call is addressed to, None for calls not bound to a chat.
+        :param func: coroutine function to call, typically a bound method of telegram.Bot
+        :param flood_attempts: total number of calls to make while the server keeps responding with 429
+        :param args: arguments for the called function
+        :param kwargs: keyword arguments for the called function
+        :return: whatever the called function returns
+        """
+        for i in range(flood_attempts):
+            await self.acquire(chat_id)
+            try:
+                return await func(*args, **kwargs)
+            except RetryAfter as e:
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                logger.warning(f'flood control exceeded for chat {chat_id}, backing off for {delay} s '
+                               f'({i + 1}/{flood_attempts})')
+                self.back_off(delay, chat_id)
+                if i == flood_attempts - 1:
+                    tb_logger.exception(e)
+                    raise
@@ -0,0 +1,72 @@
+import time
+from collections import deque
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+class CircuitBreaker:
+    """
+    Stops calls to an upstream after a run of consecutive failures, letting a single trial call through
+    once `reset_timeout` seconds have passed: success closes the circuit again, failure keeps it open.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN  # the caller gets to make the trial call
+            self.opened_at = time.monotonic()  # another trial is due if this one never reports back
+            return True
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """
+    Keeps durations of the latest successful calls to an upstream to tell its latency percentiles.
+    """
+
+    def __init__(self, size: int = 100, min_samples: int = 20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        """
+        :param q: percentile as a fraction, e.g. .95
+        :return: latency in seconds or None while there are too few samples to judge.
+        """
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+breakers: dict[str, CircuitBreaker] = {}
+latencies: dict[str, LatencyTracker] = {}
+
+
+def breaker(host: str) -> CircuitBreaker:
+    return breakers.setdefault(host, CircuitBreaker())
+
+
+def latency(host: str) -> LatencyTracker:
+    return latencies.setdefault(host, LatencyTracker())
@@ -1,16 +1,75 @@
+import os
+import re
 import sqlite3
+import sys
 
 
-with open('resources/lexitron_thai.txt') as f:
-    entries = [entry.strip() for entry in f.readlines() if entry.strip()]
+def read_dump(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+    except UnicodeDecodeError:
+        with open(path, encoding='tis-620') as f:  # original Lexitron distribution encoding
+            return f.read()
 
-conn = sqlite3.connect('resources/dictionary.db')
-c = conn.cursor()
 
-c.execute('CREATE TABLE IF NOT EXISTS lexitron_thai (id INTEGER PRIMARY KEY, entry TEXT)')
-c.execute('CREATE INDEX IF NOT EXISTS idx_entry ON lexitron_thai(entry)')
+def parse_lexitron(content):
+    definitions = []
+    for doc in re.findall(r'<Doc>(.*?)</Doc>', content, re.S):
+        fields = {tag: value.strip() for tag, value in re.findall(r'<(\w+)>(.*?)</\1>', doc, re.S)}
+        if 'tsearch' in fields:  # Thai-English
+            headword, definition, pos = fields.get('tentry'), fields.get('eentry'), fields.get('tcat')
+        else:  # English-Thai
+            headword, definition, pos = fields.get('eentry'), fields.get('tentry'), fields.get('ecat')
+        if headword and definition:
+            definitions.append((headword, pos or '', definition))
+    return definitions
 
-c.executemany('INSERT INTO lexitron_thai (entry) VALUES (?)', [(entry,) for entry in entries])
 
-conn.commit()
-conn.close()
\ No newline at end of file
+def parse_tsv(content):
+    rows = [line.split('\t') for line in content.splitlines() if line.strip()]
+    return [(row[0].strip(), row[1].strip(), row[2].strip()) for row in rows if len(row) >= 3 and row[0].strip()]
+
+
+def main(dump_path=None):
+    """
+    :param dump_path: optional bilingual dump to build the local definitions store from
+    (python resources/create_db.py <dump>): either a NECTEC Lexitron file made of <Doc> records (telex or etlex)
+    or a tab-separated file with headword, part of speech and definition per line
+    """
+    with open('resources/lexitron_thai.txt') as f:
+        entries = [entry.strip() for entry in f.readlines() if entry.strip()]
+
+    conn = sqlite3.connect('resources/dictionary.db')
+    c = conn.cursor()
+
+    c.execute('CREATE TABLE IF NOT EXISTS lexitron_thai (id INTEGER PRIMARY KEY, entry TEXT)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_entry ON lexitron_thai(entry)')
+
+    # seeded only once, so that the script can be re-run to import definitions
+    if not c.execute('SELECT 1 FROM lexitron_thai LIMIT 1').fetchone():
+        c.executemany('INSERT INTO lexitron_thai (entry) VALUES (?)', [(entry,) for entry in entries])
+
+    c.execute('CREATE TABLE IF NOT EXISTS definitions '
+              '(id INTEGER PRIMARY KEY, headword TEXT, pos TEXT, definition TEXT, source TEXT)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_headword ON definitions(headword)')
+
+    if dump_path:
+        content = read_dump(dump_path)
+        if dump_path.endswith('.tsv'):
+            source = os.path.splitext(os.path.basename(dump_path))[0]
+            definitions = parse_tsv(content)
+        else:
+            source = 'Lexitron'
+            definitions = parse_lexitron(content)
+        c.execute('DELETE FROM definitions WHERE source = ?', (source,))  # re-importing replaces earlier import
+        c.executemany('INSERT INTO definitions (headword, pos, definition, source) VALUES (?, ?, ?, ?)',
+                      [definition + (source,) for definition in definitions])
+        print(f'{len(definitions)} definitions imported from {dump_path} as {source}')
+
+    conn.commit()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
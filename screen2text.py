@@ -3,11 +3,14 @@ import functools
 import inspect
 import logging
 import os
+import random
 import sqlite3
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 from typing import Any
+from urllib.parse import urlparse
 import pytesseract
 import requests as rq
 from IPython.display import HTML
@@ -15,6 +18,9 @@ from IPython.display import display
 from PIL import ImageGrab, Image
 from bs4 import BeautifulSoup as bs
 from pythainlp import correct
+from telegram.helpers import escape_markdown
+
+import resilience
 
 pytesseract.pytesseract.tesseract_cmd = "/usr/bin/tesseract"
 
@@ -52,6 +58,12 @@ class ClipImg2Text:
     corpus_path = 'resources/dictionary.db'
     # any file with Thai dictionary words one per line will do
     # (the bigger - the better, this one is 42K+ from NECTEC's Lexitron)
+    clear_separability = .85  # histogram separability above which Otsu's threshold alone is trusted
+    fair_separability = .6  # ... above which three thresholds are tried, five below it
+    line_gap = 2  # blank pixel rows taken to separate text lines
+    region_padding = 4  # pixels of margin kept around text regions cropped for recognition
+    region_psm = 7  # regions are single lines, page segmentation modes would be wasted on them
+    max_region_calls = 60  # Tesseract calls allowed for all the regions of an image together
 
     @staticmethod
     def get_freqs(strings):
@@ -74,6 +86,7 @@ class ClipImg2Text:
         self.out_texts = {}
         self.bims = {}
         self.validated_words = {}
+        self.lines = []
         if not os.path.exists('bims'):
             os.mkdir('bims')
 
@@ -93,23 +106,75 @@ class ClipImg2Text:
         im = self.im.copy().convert("L")
         lightness = len(im.getdata()) / sum(im.getdata())  # this may result in ZeroDivisionError
         threshold = sum(im.getextrema()) / 2 * skew
-        xs, ys = im.size
-        for x in range(xs):
-            for y in range(ys):
-                if im.getpixel((x, y)) > threshold:
-                    px = 255  # if lightness > 0.25 else 0
-                else:
-                    px = 0  # if lightness > 0.25 else 255
-                im.putpixel((x, y), px)
-        return im
+        # lookup table applied natively rather than pixel by pixel in Python
+        return im.point(lambda px: 255 if px > threshold else 0)  # if lightness > 0.25 else the other way round
 
-    def fan_binarize(self):
+    def fan_binarize(self, skews=None, save=True):
+        """
+        Binarizes the image at each of the threshold :skews: (in percent of the extrema midpoint),
+        the full fixed range from 60 to 150 by default, saving the results to bims/ if :save:.
+        """
         self.bims = {}
-        for skew in range(60, 155, 5):
+        for skew in skews or range(60, 155, 5):
             bim = self.binarize(skew / 100)
-            bim.save(f'bims/{skew}.png')
+            if save:
+                bim.save(f'bims/{skew}.png')
             self.bims[skew] = bim
 
+    @staticmethod
+    def otsu(histogram):
+        """
+        takes a 256-bin grayscale :histogram: and returns Otsu's threshold along with the separability measure
+        (between-class variance over total variance, 0 to 1: the closer to 1, the more clearly bimodal the histogram)
+        and the means of the two classes split by the threshold.
+        """
+        total = sum(histogram)
+        sum_all = sum(level * count for level, count in enumerate(histogram))
+        mean_all = sum_all / total
+        variance = sum(count * (level - mean_all) ** 2 for level, count in enumerate(histogram)) / total
+        weight_dark = sum_dark = 0
+        best_between = 0
+        threshold, mean_dark, mean_light = 0, mean_all, mean_all
+        for level, count in enumerate(histogram):
+            weight_dark += count
+            sum_dark += level * count
+            weight_light = total - weight_dark
+            if not weight_dark:
+                continue
+            if not weight_light:
+                break
+            dark = sum_dark / weight_dark
+            light = (sum_all - sum_dark) / weight_light
+            between = weight_dark * weight_light * (dark - light) ** 2 / total ** 2
+            if between > best_between:
+                best_between = between
+                threshold, mean_dark, mean_light = level, dark, light
+        separability = best_between / variance if variance else 1.0
+        return threshold, separability, mean_dark, mean_light
+
+    def select_skews(self):
+        """
+        Analyzes the grayscale histogram once and picks only as many threshold skews as it calls for:
+        Otsu's threshold alone for clearly bimodal images, with two neighbours for moderately separable ones
+        and five points spread between the class means for low-contrast ones.
+        Skews are expressed the same way as in `binarize`, i.e. in percent of the extrema midpoint.
+        """
+        im = self.im.convert("L")
+        midpoint = sum(im.getextrema()) / 2
+        if not midpoint:
+            return [100]
+        threshold, separability, mean_dark, mean_light = self.otsu(im.histogram())
+        if separability >= self.clear_separability:
+            thresholds = [threshold]
+        else:
+            count = 3 if separability >= self.fair_separability else 5
+            spread = (mean_light - mean_dark) / 4
+            step = 2 * spread / (count - 1)
+            thresholds = [threshold - spread + step * i for i in range(count)]
+        skews = {max(1, round(value / midpoint * 100)) for value in thresholds}
+        logger.info(f'histogram separability {separability:.2f}, Otsu threshold {threshold}, skews {sorted(skews)}')
+        return sorted(skews)
+
     def recognize_original(self, lang='tha', config='--psm 7'):
         return pytesseract.image_to_string(self.im, config=config, lang=lang).strip()
 
@@ -140,29 +205,162 @@ class ClipImg2Text:
             self.out_texts[key] = pytesseract.image_to_string(image, lang=lang, config=f'--psm {psm}').strip()
         # print(len(self.out_texts))
 
-    def threads_recognize(self, lang, kind=None):
+    @classmethod
+    def psms_for(cls, kind=None):
+        """psm values worth trying for the :kind: of text on the image: 'block', 'line', 'word' or any"""
+        if kind == 'block':
+            return 1, 3, 4, 6, 11, 12, 13
+        if kind == 'line':
+            return 1, 3, 7, 11, 12, 13
+        if kind == 'word':
+            return 1, 3, 7, 8, 11, 12, 13
+        psms = list(cls.config_dict.keys())[3:]
+        psms.insert(0, 1)
+        return psms
+
+    def threads_recognize(self, lang, kind=None, fan='full'):
         """Recognizing the image, both original and binarized, in a range of psm values as per :kind:,
         applying a range of threshold skews as defined in `fan_recognize` run in a separate thread
-        for each psm value 
+        for each psm value. With :fan: set to 'histogram', only the skews picked by `select_skews`
+        are applied instead of the full fixed range. Blocks of several lines are split into lines
+        recognized separately by `split_recognize`.
         """
         self.kind = kind
-        self.fan_binarize()
-        lang = lang
         self.out_texts.clear()
-        psms = list(self.config_dict.keys())[3:]
-        psms.insert(0, 1)
-        if kind == 'block':
-            psms = (1, 3, 4, 6, 11, 12, 13)
-        if kind == 'line':
-            psms = (1, 3, 7, 11, 12, 13)
-        if kind == 'word':
-            psms = (1, 3, 7, 8, 11, 12, 13)
-        threads = [threading.Thread(target=self.fan_recognize, args=(lang, psm), name=f't_{psm}') for psm in psms]
+        self.bims = {}
+        self.lines = []
+        if kind == 'block' and self.split_recognize(lang):
+            return
+        self.fan_binarize(self.select_skews() if fan == 'histogram' else None)
+        threads = [threading.Thread(target=self.fan_recognize, args=(lang, psm), name=f't_{psm}')
+                   for psm in self.psms_for(kind)]
         for thread in threads:
             thread.start()
         for thread in threads:
             thread.join()
 
+    @staticmethod
+    def spans(profile, min_gap):
+        """
+        takes a projection :profile: and returns (start, end) of the stretches where it is non-zero,
+        those separated by fewer than :min_gap: zeros being taken as one
+        """
+        spans = []
+        start = last = None
+        for i, value in enumerate(profile):
+            if not value:
+                continue
+            if start is None:
+                start = i
+            elif i - last - 1 >= min_gap:
+                spans.append((start, last + 1))
+                start = i
+            last = i
+        if start is not None:
+            spans.append((start, last + 1))
+        return spans
+
+    @staticmethod
+    def merge_thin(spans, ratio=.5):
+        """
+        attaches :spans: thinner than :ratio: of the median one (such as rows of Thai vowel and tone marks
+        standing apart from their line) to the closest neighbour
+        """
+        if len(spans) < 2:
+            return spans
+        median = sorted(end - start for start, end in spans)[len(spans) // 2]
+        merged = list(spans)
+        i = 0
+        while i < len(merged) and len(merged) > 1:
+            start, end = merged[i]
+            if end - start >= median * ratio:
+                i += 1
+                continue
+            gap_before = start - merged[i - 1][1] if i > 0 else None
+            gap_after = merged[i + 1][0] - end if i < len(merged) - 1 else None
+            if gap_after is None or (gap_before is not None and gap_before <= gap_after):
+                merged[i - 1] = (merged[i - 1][0], end)
+            else:
+                merged[i + 1] = (start, merged[i + 1][1])
+            del merged[i]
+        return merged
+
+    def find_regions(self):
+        """
+        Finds text lines with the horizontal projection profile of the image binarized at Otsu's threshold,
+        trimming each line to the extent of its text. Profiles are taken with crops and bounding boxes
+        of the binarized image rather than pixel by pixel.
+        :return: (left, upper, right, lower) boxes of the lines in reading order.
+        """
+        im = self.im.convert("L")
+        xs, ys = im.size
+        histogram = im.histogram()
+        threshold = self.otsu(histogram)[0]
+        text_is_dark = sum(histogram[:threshold + 1]) <= xs * ys / 2  # text takes up the lesser part of the image
+        mask = im.point(lambda px: 255 if (px <= threshold) == text_is_dark else 0)
+        rows = [mask.crop((0, y, xs, y + 1)).getbbox() is not None for y in range(ys)]
+        pad = self.region_padding
+        lines = []
+        for top, bottom in self.merge_thin(self.spans(rows, self.line_gap)):
+            left, _, right, _ = mask.crop((0, top, xs, bottom)).getbbox()
+            lines.append((max(0, left - pad), max(0, top - pad), min(xs, right + pad), min(ys, bottom + pad)))
+        return lines
+
+    @staticmethod
+    def recognize_image(image, lang, psm):
+        return pytesseract.image_to_string(image, lang=lang, config=f'--psm {psm}').strip()
+
+    def split_recognize(self, lang):
+        """
+        Recognizes each text line found by `find_regions` on its own as a single line (`region_psm`), original and
+        binarized at the skews picked from its own histogram by `select_skews`, all lines at once across a pool of
+        worker threads. Should that take more than `max_region_calls` Tesseract calls, lines are binarized at Otsu's
+        threshold only. out_texts gets the lines put back together in reading order for the originals
+        (key `region_psm`) and for the n-th threshold picked for each line (key `region_psm` * 1000 + n),
+        the best text of every line is kept in `lines`.
+        :return: False if the image makes less than two lines, or too many to recognize within the cap,
+        and is better recognized as a whole.
+        """
+        regions = self.find_regions()
+        if len(regions) < 2:
+            return False
+        parts = []
+        for box in regions:
+            part = ClipImg2Text()
+            part.im = self.im.crop(box)
+            parts.append(part)
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            skews = list(pool.map(lambda part: part.select_skews(), parts))
+            if sum(1 + len(line_skews) for line_skews in skews) > self.max_region_calls:
+                # skews are sorted around Otsu's threshold, the middle one is the closest to it
+                skews = [line_skews[len(line_skews) // 2:][:1] for line_skews in skews]
+            calls = sum(1 + len(line_skews) for line_skews in skews)
+            if calls > self.max_region_calls:
+                logger.info(f'{len(regions)} lines would take {calls} calls, recognizing the image as a whole')
+                return False
+            # region binarizations are not saved to bims/, which keeps those of the whole image
+            for future in [pool.submit(part.fan_binarize, line_skews, False) for part, line_skews in zip(parts, skews)]:
+                future.result()
+            futures = {
+                (part, self.region_psm * 1000 + n if n else self.region_psm):
+                    pool.submit(self.recognize_image, image, lang, self.region_psm)
+                for part in parts
+                for n, image in enumerate([part.im] + [part.bims[skew] for skew in sorted(part.bims)])
+            }
+            for (part, key), future in futures.items():
+                part.out_texts[key] = future.result()
+        self.lines = [part.best_text() for part in parts]
+        for key in sorted(set().union(*(part.out_texts for part in parts))):
+            # a line with nothing recognized for the key is left out rather than filled in from elsewhere
+            self.out_texts[key] = '\n'.join(part.out_texts[key] for part in parts if part.out_texts.get(key))
+        logger.info(f'{len(regions)} line(s) recognized separately in {calls} call(s)')
+        return True
+
+    def best_text(self):
+        """the most frequent single line text among out_texts, empty string if there is none"""
+        freqs = self.get_freqs([item for item in self.out_texts.values() if item and '\n' not in item])
+        return freqs[0][0] if freqs else ''
+
     def validate_words(self):
         """
         checks recognition results gathered in out_texts against corpus.
@@ -247,45 +445,175 @@ class ClipImg2Text:
 
 class DictLookup(ClipImg2Text):
     dic_url = 'https://dict2013.longdo.com/search/'
+    local_tier_missing = False  # set once the missing definitions table has been reported
+
+    hedge_percentile = .95  # a hedged request is sent once the first one is slower than this share of recent ones
+    max_hedges = 4  # hedged requests allowed in flight at once, so a slow upstream does not eat up the executor
+    hedges = 0
+    hedges_lock = threading.Lock()
+    connect_timeout = 3  # seconds, so that calls to an unreachable upstream free their thread early
 
     @staticmethod
-    async def retry_or_none(func, attempts: int, seconds: int | float, *args, **kwargs) -> Any | None:
+    async def call_once(func, *args, **kwargs):
+        if inspect.iscoroutinefunction(func):
+            return await func(*args, **kwargs)
+        # Run the sync function in a thread pool executor
+        loop = asyncio.get_running_loop()
+        wrapped_func = functools.partial(func, *args, **kwargs)
+        return await loop.run_in_executor(None, wrapped_func)
+
+    @classmethod
+    def take_hedge(cls) -> bool:
+        with cls.hedges_lock:
+            if cls.hedges >= cls.max_hedges:
+                return False
+            cls.hedges += 1
+            return True
+
+    @classmethod
+    def release_hedge(cls):
+        with cls.hedges_lock:
+            cls.hedges -= 1
+
+    @classmethod
+    def start_hedge(cls, func, *args, **kwargs):
+        """Starts the hedged call, holding one of `max_hedges` places until the call is really over."""
+        if inspect.iscoroutinefunction(func):
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            task.add_done_callback(lambda _: cls.release_hedge())
+            return task
+
+        def hedged():
+            # a thread cannot be cancelled, so the place is given back only once the function returns
+            try:
+                return func(*args, **kwargs)
+            finally:
+                cls.release_hedge()
+
+        return asyncio.ensure_future(cls.call_once(hedged))
+
+    @classmethod
+    async def call_hedged(cls, hedge_after: float, tracker, func, *args, **kwargs):
         """
-        Tries to call the supplied function repeatedly until success or exhaustion of attempts, logging error on exception.
+        Calls the supplied function and, if it has not returned within :hedge_after: seconds, calls it once more
+        in parallel (unless `max_hedges` are already in flight), returning whichever result comes first.
+        Only suitable for idempotent calls. The first call is left to finish even if the hedged one wins, so that
+        its own latency, rather than that of the faster of the two, is added to the :tracker:.
+        """
+        start = time.monotonic()
+
+        def record(task):
+            if not task.cancelled() and task.exception() is None:
+                tracker.add(time.monotonic() - start)
+
+        primary = asyncio.ensure_future(cls.call_once(func, *args, **kwargs))
+        primary.add_done_callback(record)
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+            if not done and cls.take_hedge():
+                logger.info(f'no response in {hedge_after:.2f} s, sending hedged request')
+                hedge = cls.start_hedge(func, *args, **kwargs)
+            error = None
+            pending = {primary, hedge} - {None}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            if hedge:
+                hedge.cancel()
+
+    @classmethod
+    async def retry_or_none(cls, func, attempts: int, seconds: int | float, *args,
+                            deadline: float | None = None, backoff: float = 2, jitter: float = .5,
+                            host: str | None = None, hedge: bool = False, **kwargs) -> Any | None:
+        """
+        Tries to call the supplied function repeatedly until success or exhaustion of attempts or time,
+        logging error on exception.
         :param func: function to call
         :param attempts: total number of calls
-        :param seconds: wait time before next call
+        :param seconds: wait time before the second call, multiplied by :backoff: for every next one
         :param args: arguments for the called function
+        :param deadline: `time.monotonic()` moment by which the whole thing must be over, `timeout` keyword argument
+        of the called function (if any) is cut down to fit
+        :param backoff: factor the wait time grows by between calls
+        :param jitter: share of the wait time that may be randomly cut off to spread out retries
+        :param host: upstream the function calls, enabling the circuit breaker and latency tracking for it
+        :param hedge: whether to send a second, hedged, call when the first one is slower than usual for the host
         :param kwargs: keyword arguments for the called function
         :return: whatever the called function should return or None in case of ultimate failure
         """
+        circuit = resilience.breaker(host) if host else None
+        tracker = resilience.latency(host) if host else None
         for i in range(attempts):
+            if circuit and not circuit.allow():
+                logger.warning(f'circuit for {host} is open, failing fast')
+                return None
+            remaining = deadline - time.monotonic() if deadline else None
+            if remaining is not None and remaining <= 0:
+                logger.warning(f'deadline reached after {i} attempt(s), giving up')
+                return None
+            if remaining is not None and 'timeout' in kwargs:
+                kwargs['timeout'] = min(kwargs['timeout'], remaining)
+            hedge_after = tracker.percentile(cls.hedge_percentile) if hedge and tracker else None
+            start = time.monotonic()
             try:
-                if inspect.iscoroutinefunction(func):
-                    return await func(*args, **kwargs)
+                if hedge_after is None:
+                    call = cls.call_once(func, *args, **kwargs)
                 else:
-                    # Run the sync function in a thread pool executor
-                    loop = asyncio.get_running_loop()
-                    wrapped_func = functools.partial(func, *args, **kwargs)
-                    return await loop.run_in_executor(None, wrapped_func)
+                    call = cls.call_hedged(hedge_after, tracker, func, *args, **kwargs)
+                result = await asyncio.wait_for(call, remaining)
             except Exception as e:
-                logger.error(f"Attempt {i+1}/{attempts} failed: {e}")
+                if circuit:
+                    circuit.record_failure()
+                logger.error(f"Attempt {i+1}/{attempts} failed: {e!r}")
                 tb_logger.exception(e)
                 if i < attempts - 1:
-                    logger.info('Retrying...')
-                    await asyncio.sleep(seconds)
+                    delay = seconds * backoff ** i * (1 - jitter * random.random())
+                    if deadline and time.monotonic() + delay >= deadline:
+                        logger.warning('no time left for another attempt, giving up')
+                        return None
+                    logger.info(f'Retrying in {delay:.2f} s...')
+                    await asyncio.sleep(delay)
+                continue
+            if circuit:
+                circuit.record_success()
+            if tracker and hedge_after is None:  # hedged calls record the latency of the first request themselves
+                tracker.add(time.monotonic() - start)
+            return result
         return None
 
+    @classmethod
+    def get_page(cls, url, timeout):
+        """
+        Fetches the page, raising on server errors so that they count as failures of the upstream.
+        Connecting is given no more than `connect_timeout`, and :timeout: bounds every read.
+        """
+        response = rq.get(url, timeout=(min(cls.connect_timeout, timeout), timeout))
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
     def __init__(self):
         super().__init__()
         self.word = None
         self.soup = None
+        self.entries = []
 
-    async def lookup(self, word):
+    async def lookup(self, word, deadline: float | None = None):
+        """
+        :param word: the query to look up.
+        :param deadline: `time.monotonic()` moment by which to give up waiting for the dictionary, if any.
+        """
         self.soup = None
         self.word = word
         logger.info(f'Looking up {word}... ')
-        response = await self.retry_or_none(rq.get, 3, 1, self.dic_url + word, timeout=15)
+        response = await self.retry_or_none(self.get_page, 3, 1, self.dic_url + word, timeout=15,
+                                            deadline=deadline, host=urlparse(self.dic_url).netloc, hedge=True)
         if not response or response.status_code != 200:
             logger.warning("Couldn't fetch.")
             return False
@@ -293,6 +621,70 @@ class DictLookup(ClipImg2Text):
         self.soup = bs(response.text, features="html.parser")
         return True
 
+    def local_lookup(self, word):
+        """
+        Looks the word up in the definitions imported into the corpus database by `create_db.py`,
+        which takes milliseconds and does not depend on the online dictionary being available.
+        """
+        self.entries = []
+        self.word = word
+        try:
+            conn = sqlite3.connect(self.corpus_path)
+            cur = conn.cursor()
+            cur.execute('SELECT source, pos, definition FROM definitions WHERE headword = ? ORDER BY id', (word,))
+            self.entries = cur.fetchall()
+            cur.close()
+            conn.close()
+        except sqlite3.OperationalError as e:
+            if 'no such table' not in str(e):
+                logger.error(f"error accessing local definitions: {e}")
+                tb_logger.exception(e)
+            elif not DictLookup.local_tier_missing:
+                DictLookup.local_tier_missing = True
+                logger.warning(f'no local definitions in {self.corpus_path}, '
+                               f'run resources/create_db.py with a dump to enable the local tier')
+        except Exception as e:
+            logger.error(f"error accessing local definitions: {e}")
+            tb_logger.exception(e)
+        logger.info(f'{len(self.entries)} local definition(s) found for {word}')
+        return bool(self.entries)
+
+    def output_local_markdown(self, fetching=True):
+        """
+        :fetching: tells whether results from the online dictionary are still on the way
+        Imported texts are escaped, as any underscore or asterisk in them would break the whole message.
+        """
+        word = escape_markdown(self.word, version=1)
+        if fetching:
+            output = [f'Offline results for **{word}**, fetching more from '
+                      f'[Longdo Dictionary]({self.dic_url + self.word})...\n']
+        else:
+            output = [f'Offline results only for **{word}**, '
+                      f'[Longdo Dictionary]({self.dic_url + self.word}) is unavailable\n']
+        source = None
+        for entry_source, pos, definition in self.entries:
+            if entry_source != source:
+                source = entry_source
+                output.append(f'\n**{escape_markdown(source, version=1)}**\n\n')
+            definition = escape_markdown(definition, version=1)
+            output.append(f'- {definition} _{escape_markdown(pos, version=1)}_\n' if pos else f'- {definition}\n')
+        return ''.join(output)
+
+    def output_local_plain(self, fetching=True):
+        if fetching:
+            output = [f'Offline results for "{self.word}", fetching more from Longdo Dictionary '
+                      f'\n{self.dic_url + self.word}\n']
+        else:
+            output = [f'Offline results only for "{self.word}", Longdo Dictionary is unavailable '
+                      f'\n{self.dic_url + self.word}\n']
+        source = None
+        for entry_source, pos, definition in self.entries:
+            if entry_source != source:
+                source = entry_source
+                output.append(f'\n{source}\n\n')
+            output.append(f'- {definition} ({pos})\n' if pos else f'- {definition}\n')
+        return ''.join(output)
+
     def output_html(self):
         headers = self.soup.find_all('td', attrs={'class': 'search-table-header'})
         tables = self.soup.find_all('table', attrs={'class': 'search-result-table'})
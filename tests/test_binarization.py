@@ -0,0 +1,84 @@
+import os
+import random
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.makedirs('logs', exist_ok=True)  # screen2text logs exceptions there on import
+
+from PIL import Image
+
+from screen2text import ClipImg2Text
+
+
+def two_tone(dark, light, spread=0, size=(80, 50)):
+    """Image with half of its pixels around :dark: and half around :light:, blurred by :spread:."""
+    rnd = random.Random(1)
+    im = Image.new('L', size)
+    im.putdata([max(0, min(255, round(rnd.gauss(light if i % 2 else dark, spread))))
+                for i in range(size[0] * size[1])])
+    return im
+
+
+class OtsuTest(unittest.TestCase):
+    def test_two_levels_are_split_between_them(self):
+        histogram = [0] * 256
+        histogram[50], histogram[200] = 300, 100
+        threshold, separability, mean_dark, mean_light = ClipImg2Text.otsu(histogram)
+        self.assertTrue(50 <= threshold < 200)
+        self.assertAlmostEqual(separability, 1)
+        self.assertEqual((mean_dark, mean_light), (50, 200))
+
+    def test_evenly_spread_levels(self):
+        histogram = [0] * 256
+        for level in range(40, 201, 20):
+            histogram[level] = 10
+        self.assertEqual(ClipImg2Text.otsu(histogram), (100, .75, 70, 160))
+
+    def test_single_level(self):
+        histogram = [0] * 256
+        histogram[128] = 10
+        self.assertEqual(ClipImg2Text.otsu(histogram), (0, 1.0, 128, 128))
+
+    def test_overlapping_classes_are_less_separable(self):
+        clear = ClipImg2Text.otsu(two_tone(80, 180, 5).histogram())[1]
+        blurred = ClipImg2Text.otsu(two_tone(80, 180, 40).histogram())[1]
+        self.assertGreater(clear, blurred)
+
+
+class SelectSkewsTest(unittest.TestCase):
+    def skews(self, im):
+        x = ClipImg2Text()
+        x.im = im
+        return x.select_skews()
+
+    def test_clear_image_gets_otsu_threshold_only(self):
+        im = two_tone(80, 180, 5)
+        threshold = ClipImg2Text.otsu(im.convert('L').histogram())[0]
+        midpoint = sum(im.getextrema()) / 2
+        self.assertEqual(self.skews(im), [round(threshold / midpoint * 100)])
+
+    def test_fair_image_gets_two_neighbours(self):
+        with mock.patch.object(ClipImg2Text, 'clear_separability', 1.01), \
+                mock.patch.object(ClipImg2Text, 'fair_separability', 0):
+            skews = self.skews(two_tone(80, 180, 30))
+        self.assertEqual(len(skews), 3)
+        self.assertEqual(skews, sorted(skews))
+
+    def test_poor_image_gets_five_skews_between_class_means(self):
+        im = two_tone(80, 180, 30)
+        _, _, mean_dark, mean_light = ClipImg2Text.otsu(im.histogram())
+        midpoint = sum(im.getextrema()) / 2
+        with mock.patch.object(ClipImg2Text, 'clear_separability', 1.01), \
+                mock.patch.object(ClipImg2Text, 'fair_separability', 1.01):
+            skews = self.skews(im)
+        self.assertEqual(len(skews), 5)
+        self.assertTrue(all(mean_dark / midpoint * 100 <= skew <= mean_light / midpoint * 100 for skew in skews))
+
+    def test_black_image(self):
+        self.assertEqual(self.skews(Image.new('L', (10, 10))), [100])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'resources'))
+os.makedirs('logs', exist_ok=True)  # screen2text logs exceptions there on import
+
+from create_db import parse_lexitron, parse_tsv
+from screen2text import DictLookup
+
+
+class ParseLexitronTest(unittest.TestCase):
+    def test_thai_english_and_english_thai_records(self):
+        content = '''
+<Doc>
+<tsearch>แมว</tsearch><tentry>แมว</tentry><eentry>cat</eentry><tcat>N</tcat>
+</Doc>
+<Doc>
+<esearch>cat</esearch><eentry> cat </eentry><tentry>แมว</tentry><ecat>N</ecat>
+</Doc>'''
+        self.assertEqual(parse_lexitron(content), [('แมว', 'N', 'cat'), ('cat', 'N', 'แมว')])
+
+    def test_incomplete_records_are_skipped(self):
+        content = '<Doc><tsearch>น้ำ</tsearch><tentry>น้ำ</tentry></Doc><Doc><eentry>water</eentry></Doc>'
+        self.assertEqual(parse_lexitron(content), [])
+
+    def test_missing_category(self):
+        content = '<Doc><tsearch>น้ำ</tsearch><tentry>น้ำ</tentry><eentry>water</eentry></Doc>'
+        self.assertEqual(parse_lexitron(content), [('น้ำ', '', 'water')])
+
+
+class ParseTsvTest(unittest.TestCase):
+    def test_rows(self):
+        content = 'แมว\tN\tcat\n\nน้ำ\t\twater\t(extra)\n'
+        self.assertEqual(parse_tsv(content), [('แมว', 'N', 'cat'), ('น้ำ', '', 'water')])
+
+    def test_short_and_headless_rows_are_skipped(self):
+        self.assertEqual(parse_tsv('แมว\tN\n\tN\tcat\n'), [])
+
+
+class LocalLookupTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.x = DictLookup()
+        self.x.corpus_path = os.path.join(self.dir.name, 'dictionary.db')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def store(self, definitions):
+        conn = sqlite3.connect(self.x.corpus_path)
+        conn.execute('CREATE TABLE definitions '
+                     '(id INTEGER PRIMARY KEY, headword TEXT, pos TEXT, definition TEXT, source TEXT)')
+        conn.executemany('INSERT INTO definitions (headword, pos, definition, source) VALUES (?, ?, ?, ?)',
+                         definitions)
+        conn.commit()
+        conn.close()
+
+    def test_definitions_found_in_import_order(self):
+        self.store([('แมว', 'N', 'cat', 'Lexitron'), ('น้ำ', 'N', 'water', 'Lexitron'),
+                    ('แมว', '', 'a small domesticated carnivore', 'custom')])
+        self.assertTrue(self.x.local_lookup('แมว'))
+        self.assertEqual(self.x.entries, [('Lexitron', 'N', 'cat'), ('custom', '', 'a small domesticated carnivore')])
+
+    def test_unknown_word(self):
+        self.store([('แมว', 'N', 'cat', 'Lexitron')])
+        self.assertFalse(self.x.local_lookup('หมา'))
+        self.assertEqual(self.x.entries, [])
+
+    def test_missing_table(self):
+        self.assertFalse(self.x.local_lookup('แมว'))
+
+    def test_markdown_output_is_escaped(self):
+        self.store([('แมว', 'N_1', 'cat *pet* [animal]', 'my_dict')])
+        self.x.local_lookup('แมว')
+        output = self.x.output_local_markdown()
+        self.assertIn(r'**my\_dict**', output)
+        self.assertIn(r'- cat \*pet\* \[animal] _N\_1_', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
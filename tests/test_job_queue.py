@@ -0,0 +1,113 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_queue import JobQueue, SQLiteJobQueue, PENDING, RUNNING, DONE, FAILED
+
+
+class SQLiteJobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.queue = SQLiteJobQueue(os.path.join(self.dir.name, 'jobs.db'), max_attempts=2)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_claim_and_complete(self):
+        job_id = self.queue.put(b'image', 'tha', 'line')
+        job = self.queue.claim('a', 60)
+        self.assertEqual((job.id, job.status, job.image, job.attempts), (job_id, RUNNING, b'image', 1))
+        self.assertIsNone(self.queue.claim('b', 60))
+        self.assertTrue(self.queue.complete(job_id, 'a', [('word', 0.5)]))
+        job = self.queue.fetch(job_id)
+        self.assertEqual((job.status, job.result, job.image), (DONE, [['word', 0.5]], None))
+
+    def test_expired_lease_is_claimed_again(self):
+        job_id = self.queue.put(b'image')
+        self.queue.claim('a', 0.01)
+        time.sleep(0.02)
+        job = self.queue.claim('b', 60)
+        self.assertEqual((job.id, job.attempts), (job_id, 2))
+
+    def test_stale_worker_cannot_overwrite(self):
+        job_id = self.queue.put(b'image')
+        self.queue.claim('a', 0.01)
+        time.sleep(0.02)
+        self.queue.claim('b', 60)
+        self.assertTrue(self.queue.complete(job_id, 'b', [('word', 1.0)]))
+        self.assertFalse(self.queue.fail(job_id, 'a', 'late failure'))
+        self.assertFalse(self.queue.complete(job_id, 'a', [('other', 1.0)]))
+        job = self.queue.fetch(job_id)
+        self.assertEqual((job.status, job.result), (DONE, [['word', 1.0]]))
+
+    def test_fail_retries_until_attempts_run_out(self):
+        job_id = self.queue.put(b'image')
+        self.queue.claim('a', 60)
+        self.assertTrue(self.queue.fail(job_id, 'a', 'boom'))
+        self.assertEqual(self.queue.fetch(job_id).status, PENDING)
+        self.queue.claim('a', 60)
+        self.assertTrue(self.queue.fail(job_id, 'a', 'boom'))
+        job = self.queue.fetch(job_id)
+        self.assertEqual((job.status, job.error, job.image), (FAILED, 'boom', None))
+
+    def test_abandoned_job_fails_when_attempts_run_out(self):
+        job_id = self.queue.put(b'image')
+        for worker in ('a', 'b'):
+            self.queue.claim(worker, 0.01)
+            time.sleep(0.02)
+        self.assertIsNone(self.queue.claim('c', 60))
+        self.assertEqual(self.queue.fetch(job_id).status, FAILED)
+
+    def test_removed_job_cannot_be_completed(self):
+        job_id = self.queue.put(b'image')
+        self.queue.claim('a', 60)
+        self.queue.remove(job_id)
+        self.assertFalse(self.queue.complete(job_id, 'a', []))
+        self.assertIsNone(self.queue.fetch(job_id))
+
+    def test_purge_keeps_unfinished_and_recent_jobs(self):
+        done_id = self.queue.put(b'image')
+        self.queue.claim('a', 60)
+        self.queue.complete(done_id, 'a', [])
+        pending_id = self.queue.put(b'image')
+        self.assertEqual(self.queue.purge(60), 0)
+        time.sleep(0.02)
+        self.assertEqual(self.queue.purge(0.01), 1)
+        self.assertIsNone(self.queue.fetch(done_id))
+        self.assertEqual(self.queue.fetch(pending_id).status, PENDING)
+
+    def test_renewed_lease_keeps_job(self):
+        job_id = self.queue.put(b'image')
+        self.queue.claim('a', 0.05)
+        self.assertTrue(self.queue.renew(job_id, 'a', 60))
+        time.sleep(0.06)
+        self.assertIsNone(self.queue.claim('b', 60))
+        self.assertTrue(self.queue.complete(job_id, 'a', []))
+
+    def test_stale_worker_cannot_renew(self):
+        job_id = self.queue.put(b'image')
+        self.queue.claim('a', 0.01)
+        time.sleep(0.02)
+        self.queue.claim('b', 60)
+        self.assertFalse(self.queue.renew(job_id, 'a', 60))
+
+    def test_fetch_without_image(self):
+        job_id = self.queue.put(b'image')
+        self.assertIsNone(self.queue.fetch(job_id, with_image=False).image)
+        self.assertEqual(self.queue.fetch(job_id).image, b'image')
+
+    def test_incomplete_implementation_cannot_be_created(self):
+        class Partial(JobQueue):
+            def put(self, image, lang='tha', kind=None):
+                return 0
+
+        with self.assertRaises(TypeError):
+            Partial()
+
+
+if __name__ == '__main__':
+    unittest.main()
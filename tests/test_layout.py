@@ -0,0 +1,94 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.makedirs('logs', exist_ok=True)  # screen2text logs exceptions there on import
+
+from PIL import Image, ImageDraw
+
+from screen2text import ClipImg2Text
+
+
+def draw(size, boxes, background=255, ink=0):
+    im = Image.new('L', size, background)
+    pen = ImageDraw.Draw(im)
+    for box in boxes:
+        pen.rectangle(box, fill=ink)
+    return im
+
+
+class SpansTest(unittest.TestCase):
+    def test_stretches_split_at_gaps(self):
+        self.assertEqual(ClipImg2Text.spans([0, 1, 1, 0, 1, 0, 0, 0, 1], 2), [(1, 5), (8, 9)])
+
+    def test_empty_profile(self):
+        self.assertEqual(ClipImg2Text.spans([0, 0, 0], 1), [])
+
+    def test_profile_ending_in_text(self):
+        self.assertEqual(ClipImg2Text.spans([1, 1], 1), [(0, 2)])
+
+
+class MergeThinTest(unittest.TestCase):
+    def test_thin_span_joins_closest_neighbour(self):
+        self.assertEqual(ClipImg2Text.merge_thin([(0, 2), (4, 14), (30, 40)]), [(0, 14), (30, 40)])
+        self.assertEqual(ClipImg2Text.merge_thin([(0, 10), (25, 27), (28, 38)]), [(0, 10), (25, 38)])
+
+    def test_thick_spans_stay(self):
+        spans = [(0, 10), (20, 28), (40, 50)]
+        self.assertEqual(ClipImg2Text.merge_thin(spans), spans)
+
+    def test_single_span(self):
+        self.assertEqual(ClipImg2Text.merge_thin([(3, 4)]), [(3, 4)])
+
+
+class FindRegionsTest(unittest.TestCase):
+    def regions(self, im):
+        x = ClipImg2Text()
+        x.im = im
+        return x.find_regions()
+
+    def test_lines_in_reading_order_with_marks_attached(self):
+        im = draw((120, 60), [(5, 4, 19, 4),  # a row of marks above the first line
+                              (5, 7, 49, 14), (80, 7, 109, 14), (5, 30, 89, 39)])
+        self.assertEqual(self.regions(im), [(1, 0, 114, 19), (1, 26, 94, 44)])
+
+    def test_light_text_on_dark_background(self):
+        im = draw((100, 40), [(10, 5, 60, 12), (10, 25, 50, 32)], background=0, ink=255)
+        self.assertEqual(self.regions(im), [(6, 1, 65, 17), (6, 21, 55, 37)])
+
+
+class SplitRecognizeTest(unittest.TestCase):
+    def setUp(self):
+        self.x = ClipImg2Text()
+        self.x.im = draw((120, 100), [(5, 5 + 20 * i, 100, 14 + 20 * i) for i in range(4)])
+
+    def test_lines_recognized_as_single_lines_in_reading_order(self):
+        texts = iter(f'line {i}' for i in range(100))
+        with mock.patch.object(ClipImg2Text, 'recognize_image', side_effect=lambda *args: next(texts)) as ocr:
+            self.assertTrue(self.x.split_recognize('tha'))
+        self.assertTrue(all(call.args[2] == ClipImg2Text.region_psm for call in ocr.call_args_list))
+        self.assertLessEqual(ocr.call_count, ClipImg2Text.max_region_calls)
+        self.assertEqual(len(self.x.lines), 4)
+        self.assertEqual(self.x.out_texts[ClipImg2Text.region_psm].count('\n'), 3)
+
+    def test_empty_results_are_left_out(self):
+        with mock.patch.object(ClipImg2Text, 'recognize_image', return_value=''):
+            self.x.split_recognize('tha')
+        self.assertEqual(set(self.x.out_texts.values()), {''})
+        self.assertEqual(self.x.lines, ['', '', '', ''])
+
+    def test_too_many_lines_fall_back_to_whole_image(self):
+        with mock.patch.object(ClipImg2Text, 'max_region_calls', 3), \
+                mock.patch.object(ClipImg2Text, 'recognize_image', return_value='x') as ocr:
+            self.assertFalse(self.x.split_recognize('tha'))
+        ocr.assert_not_called()
+
+    def test_single_line_is_not_split(self):
+        self.x.im = draw((120, 30), [(5, 5, 100, 14)])
+        self.assertFalse(self.x.split_recognize('tha'))
+
+
+if __name__ == '__main__':
+    unittest.main()
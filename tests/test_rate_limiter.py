@@ -0,0 +1,124 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.makedirs('logs', exist_ok=True)  # screen2text logs exceptions there on import
+
+from telegram.error import RetryAfter
+
+from rate_limiter import TokenBucket, OutboundLimiter
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_refill_rate(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        now = bucket.updated
+        self.assertEqual([bucket.reserve(now) for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(bucket.reserve(now), 0.1)
+        self.assertAlmostEqual(bucket.reserve(now), 0.2)
+        self.assertAlmostEqual(bucket.reserve(now + 0.3), 0)
+
+    def test_refill_is_capped(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        bucket.refill(bucket.updated + 60)
+        self.assertEqual(bucket.tokens, 2)
+
+    def test_release_gives_token_back(self):
+        bucket = TokenBucket(rate=10, capacity=1)
+        now = bucket.updated
+        bucket.reserve(now)
+        bucket.reserve(now)
+        bucket.release()
+        self.assertAlmostEqual(bucket.reserve(now), 0.1)
+
+    def test_block(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        bucket.block(5)
+        now = time.monotonic()
+        self.assertAlmostEqual(bucket.reserve(now), 5, places=1)
+        self.assertFalse(bucket.is_idle(now))
+        self.assertTrue(bucket.is_idle(now + 10))
+
+
+class OutboundLimiterTest(unittest.TestCase):
+    def test_calls_in_one_chat_go_out_in_arrival_order(self):
+        limiter = OutboundLimiter(global_rate=1000, chat_rate=50, chat_burst=3)
+        order = []
+
+        async def send(i):
+            await limiter.acquire(1)
+            order.append(i)
+
+        async def scenario():
+            await asyncio.gather(*(send(i) for i in range(6)))
+
+        asyncio.run(scenario())
+        self.assertEqual(order, list(range(6)))
+
+    def test_chat_rate_is_kept(self):
+        limiter = OutboundLimiter(global_rate=1000, chat_rate=50, chat_burst=1)
+        sent = []
+
+        async def send():
+            await limiter.acquire(1)
+            sent.append(time.monotonic())
+
+        async def scenario():
+            await asyncio.gather(*(send() for _ in range(4)))
+
+        asyncio.run(scenario())
+        self.assertGreaterEqual(sent[-1] - sent[0], 3 / 50 - 0.005)
+
+    def test_chats_do_not_wait_for_each_other(self):
+        limiter = OutboundLimiter(global_rate=1000, chat_rate=1, chat_burst=1)
+
+        async def scenario():
+            await limiter.acquire(1)
+            started = time.monotonic()
+            await limiter.acquire(2)
+            return time.monotonic() - started
+
+        self.assertLess(asyncio.run(scenario()), 0.1)
+
+    def test_cancelled_wait_releases_reservation(self):
+        limiter = OutboundLimiter(global_rate=1000, chat_rate=10, chat_burst=1)
+
+        async def scenario():
+            await limiter.acquire(1)
+            waiting = asyncio.create_task(limiter.acquire(1))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            return limiter.chat_buckets[1].tokens
+
+        self.assertGreater(asyncio.run(scenario()), -0.5)
+
+    def test_call_backs_off_and_repeats_on_flood_control(self):
+        limiter = OutboundLimiter(global_rate=1000, chat_rate=1000, chat_burst=10)
+        calls = []
+
+        async def flaky():
+            calls.append(time.monotonic())
+            if len(calls) == 1:
+                raise RetryAfter(0.05)
+            return 'sent'
+
+        self.assertEqual(asyncio.run(limiter.call(1, flaky)), 'sent')
+        self.assertGreaterEqual(calls[1] - calls[0], 0.045)
+
+    def test_call_gives_up_after_flood_attempts(self):
+        limiter = OutboundLimiter(global_rate=1000, chat_rate=1000, chat_burst=10)
+
+        async def flooded():
+            raise RetryAfter(0.01)
+
+        with self.assertRaises(RetryAfter):
+            asyncio.run(limiter.call(1, flooded, flood_attempts=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
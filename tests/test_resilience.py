@@ -0,0 +1,193 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.makedirs('logs', exist_ok=True)  # screen2text logs exceptions there on import
+
+import resilience
+from resilience import CircuitBreaker, LatencyTracker, CLOSED, OPEN, HALF_OPEN
+from screen2text import DictLookup
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_consecutive_failures(self):
+        circuit = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        circuit.record_failure()
+        circuit.record_failure()
+        circuit.record_success()
+        circuit.record_failure()
+        circuit.record_failure()
+        self.assertEqual(circuit.state, CLOSED)
+        circuit.record_failure()
+        self.assertEqual(circuit.state, OPEN)
+        self.assertFalse(circuit.allow())
+
+    def test_trial_call_after_reset_timeout(self):
+        circuit = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        circuit.record_failure()
+        time.sleep(0.02)
+        self.assertTrue(circuit.allow())
+        self.assertEqual(circuit.state, HALF_OPEN)
+        self.assertFalse(circuit.allow())  # a single trial at a time
+        circuit.record_success()
+        self.assertEqual(circuit.state, CLOSED)
+        self.assertTrue(circuit.allow())
+
+    def test_failed_trial_opens_again(self):
+        circuit = CircuitBreaker(failure_threshold=5, reset_timeout=0.01)
+        for _ in range(5):
+            circuit.record_failure()
+        time.sleep(0.02)
+        circuit.allow()
+        circuit.record_failure()
+        self.assertEqual(circuit.state, OPEN)
+        self.assertFalse(circuit.allow())
+
+    def test_lost_trial_is_given_another_go(self):
+        circuit = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        circuit.record_failure()
+        time.sleep(0.02)
+        circuit.allow()
+        time.sleep(0.02)
+        self.assertTrue(circuit.allow())
+
+
+class LatencyTrackerTest(unittest.TestCase):
+    def test_no_percentile_below_min_samples(self):
+        tracker = LatencyTracker(size=10, min_samples=5)
+        for i in range(4):
+            tracker.add(i)
+        self.assertIsNone(tracker.percentile(.95))
+        tracker.add(4)
+        self.assertEqual(tracker.percentile(.95), 4)
+        self.assertEqual(tracker.percentile(.5), 2)
+
+    def test_only_latest_samples_count(self):
+        tracker = LatencyTracker(size=3, min_samples=1)
+        for seconds in (10, 10, 10, 1, 1, 1):
+            tracker.add(seconds)
+        self.assertEqual(tracker.percentile(.99), 1)
+
+
+class RetryOrNoneTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+
+    def tearDown(self):
+        resilience.breakers.clear()
+        resilience.latencies.clear()
+
+    def failing(self):
+        self.calls += 1
+        raise ConnectionError('unreachable')
+
+    def test_retries_until_success(self):
+        def flaky():
+            self.calls += 1
+            if self.calls < 3:
+                raise ConnectionError('unreachable')
+            return 'page'
+
+        self.assertEqual(asyncio.run(DictLookup.retry_or_none(flaky, 3, 0.01)), 'page')
+        self.assertEqual(self.calls, 3)
+
+    def test_backoff_gives_up_before_deadline(self):
+        started = time.monotonic()
+        result = asyncio.run(DictLookup.retry_or_none(self.failing, 5, 1, deadline=started + 0.2))
+        self.assertIsNone(result)
+        self.assertEqual(self.calls, 1)  # no time left to wait for the second attempt
+        self.assertLess(time.monotonic() - started, 0.2)
+
+    def test_passed_deadline_makes_no_call(self):
+        self.assertIsNone(asyncio.run(DictLookup.retry_or_none(self.failing, 3, 0, deadline=time.monotonic())))
+        self.assertEqual(self.calls, 0)
+
+    def test_timeout_cut_down_to_deadline(self):
+        def page(timeout):
+            return timeout
+
+        timeout = asyncio.run(DictLookup.retry_or_none(page, 1, 0, timeout=15, deadline=time.monotonic() + 1))
+        self.assertLessEqual(timeout, 1)
+
+    def test_open_circuit_fails_fast(self):
+        for _ in range(resilience.breaker('down').failure_threshold):
+            asyncio.run(DictLookup.retry_or_none(self.failing, 1, 0, host='down'))
+        calls = self.calls
+        self.assertIsNone(asyncio.run(DictLookup.retry_or_none(self.failing, 3, 0, host='down')))
+        self.assertEqual(self.calls, calls)
+
+    def test_latency_recorded_on_success_only(self):
+        asyncio.run(DictLookup.retry_or_none(lambda: 'page', 1, 0, host='up'))
+        asyncio.run(DictLookup.retry_or_none(self.failing, 1, 0, host='up'))
+        self.assertEqual(len(resilience.latency('up').samples), 1)
+
+
+class HedgeTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+
+    async def slow_then_fast(self):
+        self.calls += 1
+        await asyncio.sleep(0.2 if self.calls == 1 else 0.01)
+        return self.calls
+
+    def test_hedged_call_wins_and_primary_latency_is_recorded(self):
+        tracker = LatencyTracker(min_samples=1)
+
+        async def scenario():
+            result = await DictLookup.call_hedged(0.02, tracker, self.slow_then_fast)
+            recorded_early = list(tracker.samples)
+            await asyncio.sleep(0.25)
+            return result, recorded_early
+
+        result, recorded_early = asyncio.run(scenario())
+        self.assertEqual(result, 2)
+        self.assertEqual(recorded_early, [])
+        self.assertEqual(len(tracker.samples), 1)
+        self.assertGreaterEqual(tracker.samples[0], 0.2)
+        self.assertEqual(DictLookup.hedges, 0)
+
+    def test_hedges_in_flight_are_capped(self):
+        in_flight = []
+
+        async def slow():
+            self.calls += 1
+            in_flight.append(DictLookup.hedges)
+            await asyncio.sleep(0.05)
+            return 'page'
+
+        async def scenario():
+            return await asyncio.gather(*(
+                DictLookup.call_hedged(0.01, LatencyTracker(), slow) for _ in range(3)
+            ))
+
+        with mock.patch.object(DictLookup, 'max_hedges', 1):
+            self.assertEqual(asyncio.run(scenario()), ['page'] * 3)
+        self.assertEqual(self.calls, 4)  # three first requests and a single hedged one
+        self.assertLessEqual(max(in_flight), 1)
+        self.assertEqual(DictLookup.hedges, 0)
+
+    def test_sync_hedge_holds_its_place_until_it_returns(self):
+        def slow():
+            self.calls += 1
+            call = self.calls
+            time.sleep(0.1 if call == 1 else 0.3)
+            return call
+
+        async def scenario():
+            result = await DictLookup.call_hedged(0.02, LatencyTracker(), slow)
+            held = DictLookup.hedges
+            await asyncio.sleep(0.3)
+            return result, held
+
+        result, held = asyncio.run(scenario())
+        self.assertEqual(result, 1)
+        self.assertEqual((held, DictLookup.hedges), (1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()